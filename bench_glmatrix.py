@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmarks for the glmatrix hot paths.
+#
+# Usage :
+#
+#	python -m bench_glmatrix [--sizes 1,100,10000] [--filter mat4_] [--backend numpy] [--json out.json] [--compare old.json]
+#
+# Every case performs N operations per run, N being each of the requested sizes.
+# Scalar cases call the function N times in a loop, batched cases make a single
+# call over N packed items. Results are reported as :
+#
+#	ns/op		best time per operation out of several repeats
+#	ops/s		the inverse of ns/op
+#	kept/op		memory blocks still held per operation, results kept alive
+#	peakB/call	peak traced memory of a single call, temporaries included
+#
+# Scalar cases collect the N return values in a list, so functions that allocate
+# their result show up in kept/op while those writing into dest do not.
+# peakB/call measures one call of the function on its own, a scalar operation
+# for scalar cases and the whole N item call for batched cases, so temporaries
+# freed before the call returns are counted in full.
+#
+# NumPy and Pyrr are used as reference baselines when they are installed.
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from array import array
+
+import glmatrix
+from glmatrix import *
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	import pyrr
+except ImportError:
+	pyrr = None
+
+################################################################################
+
+# Registered cases : (name, kind, builder). A builder takes N and returns a
+# callable performing N operations and returning what they produced.
+CASES = []
+
+def case(name, kind='scalar'):
+	def register(builder):
+		CASES.append((name, kind, builder))
+		return builder
+
+	return register
+
+# Registers a scalar case calling fn N times on the arguments from make_args.
+# The function is looked up at run time so a swapped backend is measured too.
+def scalar_case(name, make_args, fn=None, kind='scalar'):
+	def builder(n):
+		f = fn or getattr(glmatrix, name.split(' ')[0])
+		args = make_args()
+		indices = range(n)
+
+		def run():
+			return [f(*args) for i in indices]
+
+		# The single call measured by peak_bytes_per_call
+		run.call = (f, args)
+
+		return run
+
+	CASES.append((name, kind, builder))
+
+def random_mat4():
+	m = mat4_identity(None)
+	mat4_translate(m, [random.uniform(-5, 5) for i in range(3)], None)
+	mat4_rotate(m, random.uniform(-3, 3), [random.uniform(0.1, 1) for i in range(3)], None)
+	mat4_scale(m, [random.uniform(0.5, 2) for i in range(3)], None)
+	return m
+
+def random_rigid_mat4():
+	return mat4_fromRotationTranslation(random_quat(), random_vec3(), None)
+
+def random_quat():
+	return quat_normalize([random.gauss(0, 1) for i in range(4)], None)
+
+def random_vec3():
+	return [random.uniform(-5, 5) for i in range(3)]
+
+# Contiguous buffer of N packed items, as NumPy array when available
+def packed(items):
+	flat = [x for item in items for x in item]
+
+	if (None != numpy):
+		return numpy.array(flat, dtype=numpy.float64).reshape(len(items), -1)
+
+	return array('d', flat)
+
+################################################################################
+
+# Scalar cases
+
+scalar_case('vec3_add', lambda: (random_vec3(), random_vec3(), vec3_create(None)))
+scalar_case('vec3_normalize', lambda: (random_vec3(), vec3_create(None)))
+scalar_case('axis_to_quat', lambda: (random_vec3(), 0.3, quat_create(None)))
+scalar_case('vec3_cross', lambda: (random_vec3(), random_vec3(), vec3_create(None)))
+scalar_case('vec3_project', lambda: (random_vec3(), mat4_lookAt([0, 2, 10], [0, 0, 0], [0, 1, 0], None), mat4_perspective(60, 1.5, 0.1, 100, None), [0.0, 0.0, 1920.0, 1080.0], vec3_create(None)))
+scalar_case('vec3_unproject', lambda: ([960.0, 540.0, 0.5], mat4_lookAt([0, 2, 10], [0, 0, 0], [0, 1, 0], None), mat4_perspective(60, 1.5, 0.1, 100, None), [0.0, 0.0, 1920.0, 1080.0], vec3_create(None)))
+
+scalar_case('mat4_multiply', lambda: (random_mat4(), random_mat4(), mat4_create(None)))
+scalar_case('mat4_inverse', lambda: (random_mat4(), mat4_create(None)))
+scalar_case('mat4_inverse_affine', lambda: (random_mat4(), mat4_create(None)))
+scalar_case('mat4_inverse_rigid', lambda: (random_rigid_mat4(), mat4_create(None)))
+scalar_case('mat4_transpose', lambda: (random_mat4(), mat4_create(None)))
+scalar_case('mat4_translate', lambda: (random_mat4(), random_vec3(), mat4_create(None)))
+scalar_case('mat4_rotate', lambda: (random_mat4(), 0.3, random_vec3(), mat4_create(None)))
+scalar_case('mat4_rotateX', lambda: (random_mat4(), 0.3, mat4_create(None)))
+scalar_case('mat4_rotate identity', lambda: (mat4_identity(None), 0.3, [0.0, 1.0, 0.0], mat4_create(None)), lambda m, angle, axis, dest: mat4_rotate(mat4_identity(dest), angle, axis, None))
+scalar_case('TrigCache.mat4', lambda: (TrigCache(), 'y', radians(30), mat4_create(None)), lambda cache, axis, angle, dest: cache.mat4(axis, angle, dest))
+scalar_case('mat4_scale', lambda: (random_mat4(), random_vec3(), mat4_create(None)))
+scalar_case('mat4_multiplyVec3', lambda: (random_mat4(), random_vec3(), vec3_create(None)))
+scalar_case('mat4_multiplyVec4', lambda: (random_mat4(), random_vec3() + [1.0], vec4_create(None)))
+scalar_case('mat4_lookAt', lambda: (random_vec3(), random_vec3(), [0.0, 1.0, 0.0], mat4_create(None)))
+scalar_case('mat4_perspective', lambda: (60, 1.5, 0.1, 100, mat4_create(None)))
+scalar_case('MatrixCache.perspective', lambda: (MatrixCache(), 60, 1.5, 0.1, 100, mat4_create(None)), lambda cache, fovy, aspect, near, far, dest: cache.perspective(fovy, aspect, near, far, dest))
+scalar_case('MatrixCache.lookAt', lambda: (MatrixCache(), random_vec3(), random_vec3(), [0.0, 1.0, 0.0], mat4_create(None)), lambda cache, eye, center, up, dest: cache.lookAt(eye, center, up, dest))
+scalar_case('MatrixCache.perspective inverse', lambda: (MatrixCache(), 60, 1.5, 0.1, 100, mat4_create(None)), lambda cache, fovy, aspect, near, far, dest: cache.perspective(fovy, aspect, near, far, dest, True))
+scalar_case('mat4_fromRotationTranslation', lambda: (random_quat(), random_vec3(), mat4_create(None)))
+scalar_case('mat4_fromRotationTranslationScale', lambda: (random_quat(), random_vec3(), random_vec3(), mat4_create(None)))
+scalar_case('mat4_decompose', lambda: (random_mat4(),))
+
+def trs_chain(t, q, s, parent, dest):
+	m = gl_mat4_from_translation(t)
+	r = mat4_create(None)
+	gl_mat4_from_quat(q, r)
+	mat4_multiply(m, r, None)
+	mat4_scale(m, s, None)
+	return mat4_multiply(parent, m, dest)
+
+scalar_case('TRS chain', lambda: (random_vec3(), random_quat(), random_vec3(), random_mat4(), mat4_create(None)), trs_chain)
+scalar_case('compose TRS', lambda: (random_vec3(), random_quat(), random_vec3(), random_mat4(), mat4_create(None)), lambda t, q, s, parent, dest: compose().translate(t).rotateQuat(q).scale(s).then(parent).matrix(dest))
+
+scalar_case('quat_multiply', lambda: (random_quat(), random_quat(), quat_create(None)))
+scalar_case('quat_multiplyVec3', lambda: (random_quat(), random_vec3(), vec3_create(None)))
+scalar_case('quat_slerp', lambda: (random_quat(), random_quat(), 0.3, quat_create(None)))
+scalar_case('quat_from_mat4', lambda: (random_rigid_mat4(),))
+
+scalar_case('trackball', lambda: (quat_create(None), 0.1, 0.2, 0.15, 0.25))
+scalar_case('Trackball.drag', lambda: (Trackball(), 0.1, 0.2, 0.15, 0.25), lambda tb, p1x, p1y, p2x, p2y: tb.drag(p1x, p1y, p2x, p2y))
+
+def matstack_traversal(ms, m):
+	ms.pushMatrix()
+	ms.multMatrix(m)
+	ms.popMatrix()
+
+def make_stack(stack):
+	stack.loadIdentityMatrix()
+	return (stack, random_mat4())
+
+scalar_case('matstack push/mult/pop', lambda: make_stack(matstack()), matstack_traversal)
+scalar_case('fixedmatstack push/mult/pop', lambda: make_stack(fixedmatstack()), matstack_traversal)
+
+################################################################################
+
+# Batched cases
+
+@case('mat4_multiply_batch', 'batch')
+def bench_mat4_multiply_batch(n):
+	a = packed([random_mat4() for i in range(n)])
+	b = packed([random_mat4() for i in range(n)])
+	d = packed([mat4_create(None) for i in range(n)])
+
+	def run():
+		return mat4_multiply_batch(a, b, d)
+
+	return run
+
+@case('mat4_inverse_batch', 'batch')
+def bench_mat4_inverse_batch(n):
+	a = packed([random_mat4() for i in range(n)])
+	d = packed([mat4_create(None) for i in range(n)])
+
+	def run():
+		return mat4_inverse_batch(a, d)
+
+	return run
+
+@case('mat4_inverse_rigid_batch', 'batch')
+def bench_mat4_inverse_rigid_batch(n):
+	a = packed([random_rigid_mat4() for i in range(n)])
+	d = packed([mat4_create(None) for i in range(n)])
+
+	def run():
+		return mat4_inverse_rigid_batch(a, d)
+
+	return run
+
+@case('mat4_decompose_batch', 'batch')
+def bench_mat4_decompose_batch(n):
+	a = packed([random_mat4() for i in range(n)])
+	t = packed([vec3_create(None) for i in range(n)])
+	r = packed([quat_create(None) for i in range(n)])
+	s = packed([vec3_create(None) for i in range(n)])
+
+	def run():
+		return mat4_decompose_batch(a, t, r, s)
+
+	return run
+
+@case('quat_from_mat4_batch', 'batch')
+def bench_quat_from_mat4_batch(n):
+	a = packed([random_rigid_mat4() for i in range(n)])
+	d = packed([quat_create(None) for i in range(n)])
+
+	def run():
+		return quat_from_mat4_batch(a, d, True, True)
+
+	return run
+
+def random_frustum_planes():
+	view = mat4_lookAt([0, 3, 10], [0, 0, 0], [0, 1, 0], None)
+	proj = mat4_perspective(60, 1.5, 0.5, 50, None)
+	return frustum_planes_from_mat4(mat4_multiply(proj, view, mat4_create(None)))
+
+@case('cull_spheres', 'batch')
+def bench_cull_spheres(n):
+	planes = random_frustum_planes()
+	centers = packed([[random.uniform(-30, 30) for k in range(3)] for i in range(n)])
+
+	def run():
+		return cull_spheres(planes, centers, 1.0)
+
+	return run
+
+@case('cull_aabbs', 'batch')
+def bench_cull_aabbs(n):
+	planes = random_frustum_planes()
+	mins = packed([[random.uniform(-30, 30) for k in range(3)] for i in range(n)])
+	maxs = mins + 1.0 if (None != numpy) else array('d', [x + 1.0 for x in mins])
+
+	def run():
+		return cull_aabbs(planes, mins, maxs)
+
+	return run
+
+@case('vec3_unproject_batch', 'batch')
+def bench_vec3_unproject_batch(n):
+	view = mat4_lookAt([0, 2, 10], [0, 0, 0], [0, 1, 0], None)
+	proj = mat4_perspective(60, 1.5, 0.1, 100, None)
+	w = packed([[random.uniform(0, 1920), random.uniform(0, 1080), random.random()] for i in range(n)])
+	d = packed([vec3_create(None) for i in range(n)])
+
+	def run():
+		return vec3_unproject_batch(w, view, proj, [0, 0, 1920, 1080], d)
+
+	return run
+
+@case('vec3_project_batch', 'batch')
+def bench_vec3_project_batch(n):
+	view = mat4_lookAt([0, 2, 10], [0, 0, 0], [0, 1, 0], None)
+	proj = mat4_perspective(60, 1.5, 0.1, 100, None)
+	v = packed([[random.uniform(-30, 30) for k in range(3)] for i in range(n)])
+	d = packed([vec3_create(None) for i in range(n)])
+
+	def run():
+		return vec3_project_batch(v, view, proj, [0, 0, 1920, 1080], d)
+
+	return run
+
+@case('Composer.matrices', 'batch')
+def bench_composer_matrices(n):
+	t = packed([random_vec3() for i in range(n)])
+	q = packed([random_quat() for i in range(n)])
+	s = packed([random_vec3() for i in range(n)])
+	d = packed([mat4_create(None) for i in range(n)])
+	c = compose().translate(t).rotateQuat(q).scale(s).then(random_mat4())
+
+	def run():
+		return c.matrices(d)
+
+	return run
+
+@case('mat4_fromRotationTranslationScale_batch', 'batch')
+def bench_mat4_fromRotationTranslationScale_batch(n):
+	q = packed([random_quat() for i in range(n)])
+	t = packed([random_vec3() for i in range(n)])
+	s = packed([random_vec3() for i in range(n)])
+	d = packed([mat4_create(None) for i in range(n)])
+
+	def run():
+		return mat4_fromRotationTranslationScale_batch(q, t, s, d)
+
+	return run
+
+@case('mat4_multiplyVec3_batch', 'batch')
+def bench_mat4_multiplyVec3_batch(n):
+	m = random_mat4()
+	v = packed([random_vec3() for i in range(n)])
+	d = packed([vec3_create(None) for i in range(n)])
+
+	def run():
+		return mat4_multiplyVec3_batch(m, v, d)
+
+	return run
+
+@case('mat4_multiplyVec4_batch', 'batch')
+def bench_mat4_multiplyVec4_batch(n):
+	m = random_mat4()
+	v = packed([random_vec3() + [1.0] for i in range(n)])
+	d = packed([vec4_create(None) for i in range(n)])
+
+	def run():
+		return mat4_multiplyVec4_batch(m, v, d)
+
+	return run
+
+@case('quat_slerp_batch', 'batch')
+def bench_quat_slerp_batch(n):
+	a = packed([random_quat() for i in range(n)])
+	b = packed([random_quat() for i in range(n)])
+	d = packed([quat_create(None) for i in range(n)])
+
+	def run():
+		return quat_slerp_batch(a, b, 0.3, d)
+
+	return run
+
+# Shallow random hierarchy of N nodes, about 8 children per node, all of them
+# recomputed on every update
+@case('SceneGraph.update', 'batch')
+def bench_scenegraph_update(n):
+	graph = SceneGraph()
+	for i in range(n):
+		graph.addNode(-1 if i == 0 else random.randrange(max(1, i // 8)), random_vec3(), random_quat())
+
+	def run():
+		graph.markDirty()
+		return graph.update()
+
+	return run
+
+# Same hierarchy with 5% of the nodes moving between updates
+@case('SceneGraph.update 5% dirty', 'batch')
+def bench_scenegraph_update_dirty(n):
+	graph = SceneGraph()
+	for i in range(n):
+		graph.addNode(-1 if i == 0 else random.randrange(max(1, i // 8)), random_vec3(), random_quat())
+
+	graph.update()
+	moving = random.sample(range(n), max(1, n // 20))
+	offset = random_vec3()
+
+	def run():
+		for i in moving:
+			graph.setTranslation(i, offset)
+
+		return graph.update()
+
+	return run
+
+################################################################################
+
+# Reference baselines
+
+if (None != numpy):
+
+	@case('numpy matmul', 'baseline')
+	def bench_numpy_matmul(n):
+		a = numpy.random.rand(n, 4, 4)
+		b = numpy.random.rand(n, 4, 4)
+		d = numpy.empty((n, 4, 4))
+
+		def run():
+			return numpy.matmul(a, b, out=d)
+
+		return run
+
+	@case('numpy inv', 'baseline')
+	def bench_numpy_inv(n):
+		a = numpy.array([random_mat4() for i in range(n)]).reshape(n, 4, 4)
+
+		def run():
+			return numpy.linalg.inv(a)
+
+		return run
+
+if (None != pyrr):
+
+	def pyrr_mat4():
+		return numpy.array(random_mat4(), dtype=numpy.float32).reshape(4, 4)
+
+	def pyrr_quat():
+		return numpy.array(random_quat(), dtype=numpy.float32)
+
+	scalar_case('pyrr matrix44.multiply', lambda: (pyrr_mat4(), pyrr_mat4()), pyrr.matrix44.multiply, 'baseline')
+	scalar_case('pyrr matrix44.inverse', lambda: (pyrr_mat4(),), pyrr.matrix44.inverse, 'baseline')
+	scalar_case('pyrr quaternion.slerp', lambda: (pyrr_quat(), pyrr_quat(), 0.3), pyrr.quaternion.slerp, 'baseline')
+
+################################################################################
+
+# Measurement
+
+# Best time of one run, with enough inner loops to last at least min_time
+def time_run(run, min_time, repeat):
+	number = 1
+
+	while True:
+		t0 = time.perf_counter()
+		for i in range(number):
+			run()
+		elapsed = time.perf_counter() - t0
+
+		if elapsed >= min_time :
+			break
+
+		number = number * 2 if elapsed <= 0 else max(number * 2, int(number * min_time / elapsed) + 1)
+
+	best = elapsed
+	for r in range(repeat - 1):
+		t0 = time.perf_counter()
+		for i in range(number):
+			run()
+		best = min(best, time.perf_counter() - t0)
+
+	return best / number
+
+# Memory blocks still held per operation, keeping what the run returns alive.
+# Blocks freed before the run ends are not seen here, see peak_bytes_per_call.
+# Measured on runs of at least ALLOC_PROBE operations, so that object free
+# lists are exhausted and the cost of collecting the results is spread thin.
+ALLOC_PROBE = 1024
+
+def kept_blocks_per_op(run, n):
+	run()
+
+	before = sys.getallocatedblocks()
+	kept = run()
+	after = sys.getallocatedblocks()
+
+	return max(0, after - before) / n
+
+# Peak traced memory of one call after a warm-up, temporaries included : one
+# scalar operation, or the single call a batched case makes
+def peak_bytes_per_call(run):
+	f, args = getattr(run, 'call', (run, ()))
+
+	return allocated_bytes(f, *args)
+
+def measure(name, kind, builder, n, min_time, repeat):
+	run = builder(n)
+	seconds = time_run(run, min_time, repeat)
+	ns = seconds * 1e9 / n
+	peak = peak_bytes_per_call(run)
+
+	probe = max(n, ALLOC_PROBE)
+	run = builder(probe)
+
+	return {
+		'name' : name,
+		'kind' : kind,
+		'size' : n,
+		'ns_per_op' : ns,
+		'ops_per_s' : 1e9 / ns if ns > 0 else float('inf'),
+		'kept_blocks_per_op' : kept_blocks_per_op(run, probe),
+		'peak_bytes_per_call' : peak,
+	}
+
+################################################################################
+
+def print_results(results, previous=None):
+	before = {}
+	if previous :
+		for r in previous :
+			before[(r['name'], r['size'])] = r['ns_per_op']
+
+	header = '%-32s %-8s %8s %12s %14s %10s %10s' % ('case', 'kind', 'N', 'ns/op', 'ops/s', 'kept/op', 'peakB/call')
+	if previous :
+		header += ' %8s' % 'speedup'
+	print(header)
+
+	for r in results :
+		line = '%-32s %-8s %8d %12.1f %14.0f %10.3f %10.1f' % (r['name'], r['kind'], r['size'], r['ns_per_op'], r['ops_per_s'], r['kept_blocks_per_op'], r['peak_bytes_per_call'])
+
+		key = (r['name'], r['size'])
+		if previous and key in before :
+			line += ' %7.2fx' % (before[key] / r['ns_per_op'])
+
+		print(line)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='python -m bench_glmatrix', description='Benchmark glmatrix functions.')
+	parser.add_argument('--sizes', default='1,100,10000', help='comma separated numbers of operations per run')
+	parser.add_argument('--filter', default='', help='only run cases whose name contains this text')
+	parser.add_argument('--min-time', type=float, default=0.05, help='minimum seconds per timed repeat')
+	parser.add_argument('--repeat', type=int, default=3, help='timed repeats, the best one is reported')
+	parser.add_argument('--backend', default='python', help='glmatrix backend to measure, python or numpy')
+	parser.add_argument('--json', help='write results to this JSON file')
+	parser.add_argument('--compare', help='JSON file from an earlier run to compare against')
+	args = parser.parse_args(argv)
+
+	glmatrix.set_backend(args.backend)
+	random.seed(1)
+	sizes = [int(s) for s in args.sizes.split(',') if s]
+
+	results = []
+	for name, kind, builder in CASES :
+		if args.filter not in name :
+			continue
+
+		for n in sizes :
+			results.append(measure(name, kind, builder, n, args.min_time, args.repeat))
+
+	previous = None
+	if args.compare :
+		with open(args.compare) as f:
+			previous = json.load(f)['results']
+
+	print_results(results, previous)
+
+	if args.json :
+		report = {
+			'meta' : {
+				'python' : platform.python_version(),
+				'implementation' : platform.python_implementation(),
+				'platform' : platform.platform(),
+				'backend' : args.backend,
+				'numpy' : getattr(numpy, '__version__', None),
+				'pyrr' : getattr(pyrr, '__version__', None),
+				'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+			},
+			'results' : results,
+		}
+
+		with open(args.json, 'w') as f:
+			json.dump(report, f, indent=1)
+
+if __name__ == '__main__':
+	main()
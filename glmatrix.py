@@ -33,9 +33,34 @@
 
 ################################################################################
 
+import json
+import numbers
+import os
 import sys
+import time
+import tracemalloc
+from array import array
+from collections import OrderedDict
 from math import *
 
+# NumPy is optional; batched functions use it when present and otherwise fall
+# back to plain Python loops over flat buffers.
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+# Out parameters
+#
+# Functions write their result into dest and return it. With dest None the
+# result goes into the first argument when it has the shape of the result, and
+# into a newly created value otherwise, as for builders like mat4_perspective
+# and conversions like mat3_toMat4. Aliasing is checked by identity, so dest
+# may be one of the inputs. Temporaries live in the scratch buffers below
+# instead of fresh lists; allocated_bytes() measures what a call allocates.
+# The scratch buffers make those functions unsafe to share between threads.
+_scratch_mat4 = [0.0] * 16
+
 ################################################################################
 
 def vec3_create(vec):
@@ -62,7 +87,7 @@ def vec3_set(vec, dest):
 
 def vec3_add(vec, vec2, dest):
 
-	if (None==dest or vec == dest):
+	if (dest is None or vec is dest):
 		vec[0] = vec[0] + vec2[0]
 		vec[1] = vec[1] + vec2[1]
 		vec[2] = vec[2] + vec2[2]
@@ -77,7 +102,7 @@ def vec3_add(vec, vec2, dest):
 
 def vec3_subtract(vec, vec2, dest):
 
-	if (None==dest or vec == dest):
+	if (dest is None or vec is dest):
 		vec[0] = vec[0] - vec2[0]
 		vec[1] = vec[1] - vec2[1]
 		vec[2] = vec[2] - vec2[2]
@@ -92,7 +117,7 @@ def vec3_subtract(vec, vec2, dest):
 
 def vec3_multiply(vec, vec2, dest):
 
-	if (None==dest or vec == dest):
+	if (dest is None or vec is dest):
 		vec[0] = vec[0] * vec2[0]
 		vec[1] = vec[1] * vec2[1]
 		vec[2] = vec[2] * vec2[2]
@@ -107,7 +132,7 @@ def vec3_multiply(vec, vec2, dest):
 
 def vec3_negate(vec, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = vec
 	
 	dest[0] = -vec[0]
@@ -118,7 +143,7 @@ def vec3_negate(vec, dest):
 
 def vec3_scale(vec, val, dest):
 
-	if (None==dest or vec == dest):
+	if (dest is None or vec is dest):
 		
 		vec[0] = vec[0] * val
 		vec[1] = vec[1] * val
@@ -134,7 +159,7 @@ def vec3_scale(vec, val, dest):
 
 def vec3_normalize(vec, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = vec
 
 	x = vec[0]
@@ -168,7 +193,7 @@ def vec3_normalize(vec, dest):
 
 def vec3_cross(vec, vec2, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = vec
 	
 	x = vec[0]
@@ -198,7 +223,7 @@ def vec3_dot(vec, vec2):
 
 def vec3_direction(vec, vec2, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = vec
 	
 	x = vec[0] - vec2[0]
@@ -222,7 +247,7 @@ def vec3_direction(vec, vec2, dest):
 
 def vec3_lerp(vec, vec2, lerp, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = vec
 
 	dest[0] = vec[0] + lerp * (vec2[0] - vec[0])
@@ -241,30 +266,59 @@ def vec3_dist(vec, vec2):
 
 def vec3_unproject(vec, view, proj, viewport, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = vec
 
-	m = mat4_create(None)
-	v = [0]*4
-
-	v[0] = (vec[0] - viewport[0]) * 2.0 / viewport[2] - 1.0
-	v[1] = (vec[1] - viewport[1]) * 2.0 / viewport[3] - 1.0
-	v[2] = 2.0 * vec[2] - 1.0
-	v[3] = 1.0
+	x = (vec[0] - viewport[0]) * 2.0 / viewport[2] - 1.0
+	y = (vec[1] - viewport[1]) * 2.0 / viewport[3] - 1.0
+	z = 2.0 * vec[2] - 1.0
 
-	mat4_multiply(proj, view, m)
+	if (_matrixcache is None):
+		m = _scratch_mat4
+		mat4_multiply(proj, view, m)
+		
+		if (mat4_inverse(m, None) is None):
+			return None
+	
+	else:
+		m = _matrixcache.viewProjInverse(view, proj)
+		
+		if (m is None):
+			return None
+	
+	w = m[3] * x + m[7] * y + m[11] * z + m[15]
 	
-	if (None==mat4_inverse(m, None)):
+	if (w == 0.0):
 		return None
 	
-	mat4_multiplyVec4(m, v, None)
+	dest[0] = (m[0] * x + m[4] * y + m[8] * z + m[12]) / w
+	dest[1] = (m[1] * x + m[5] * y + m[9] * z + m[13]) / w
+	dest[2] = (m[2] * x + m[6] * y + m[10] * z + m[14]) / w
+
+	return dest
+
+def vec3_project(vec, view, proj, viewport, dest):
+
+	if (dest is None):
+		dest = vec
+
+	m = _scratch_mat4
+	x = vec[0]
+	y = vec[1]
+	z = vec[2]
+
+	mat4_multiply(proj, view, m)
+	
+	w = m[3] * x + m[7] * y + m[11] * z + m[15]
 	
-	if (v[3] == 0.0):
+	if (w <= 0.0):
 		return None
 	
-	dest[0] = v[0] / v[3]
-	dest[1] = v[1] / v[3]
-	dest[2] = v[2] / v[3]
+	w = 1 / w
+	
+	dest[0] = viewport[0] + ((m[0] * x + m[4] * y + m[8] * z + m[12]) * w + 1.0) * viewport[2] * 0.5
+	dest[1] = viewport[1] + ((m[1] * x + m[5] * y + m[9] * z + m[13]) * w + 1.0) * viewport[3] * 0.5
+	dest[2] = ((m[2] * x + m[6] * y + m[10] * z + m[14]) * w + 1.0) * 0.5
 
 	return dest
 
@@ -299,7 +353,7 @@ def vec4_set(vec, dest):
 def mat3_create(mat):
 	dest = [0.0]*9
 	
-	if None != mat :
+	if mat is not None :
 		dest[0] = mat[0]
 		dest[1] = mat[1]
 		dest[2] = mat[2]
@@ -327,7 +381,7 @@ def mat3_set(mat, dest):
 
 def mat3_identity(dest):
 
-	if None == dest :
+	if dest is None :
 		dest = mat3_create(None)
 	
 	dest[0] = 1
@@ -347,7 +401,7 @@ def mat3_identity(dest):
 def mat3_transpose(mat, dest):
 
 	# If we are transposing ourselves we can skip a few steps but have to cache some values
-	if (None == dest) or (mat == dest):
+	if (dest is None) or (mat is dest):
 	
 		a01 = mat[1]
 		a02 = mat[2]
@@ -376,7 +430,7 @@ def mat3_transpose(mat, dest):
 
 def mat3_toMat4(mat, dest):
 
-	if None == dest:
+	if dest is None:
 		dest = mat4_create(None)
 	
 	dest[15] = 1
@@ -399,6 +453,9 @@ def mat3_toMat4(mat, dest):
 	dest[1] = mat[1]
 	dest[0] = mat[0]
 
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_AFFINE
+	
 	return dest
 
 ################################################################################
@@ -446,11 +503,14 @@ def mat4_set(mat, dest):
 	dest[14] = mat[14]
 	dest[15] = mat[15]
 	
+	if (type(dest) is Mat4):
+		dest.kind = _mat4_kind(mat)
+	
 	return dest
 
 def mat4_identity(dest):
 
-	if (None==dest):
+	if (dest is None):
 	
 		dest = mat4_create(None)
 	
@@ -474,12 +534,15 @@ def mat4_identity(dest):
 	dest[14] = 0
 	dest[15] = 1
 	
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_RIGID
+	
 	return dest
 
 def mat4_transpose(mat, dest):
 
 	#If we are transposing ourselves we can skip a few steps but have to cache some values
-	if (None==dest or mat == dest):
+	if (dest is None or mat is dest):
 	
 		a01 = mat[1] 
 		a02 = mat[2] 
@@ -501,6 +564,9 @@ def mat4_transpose(mat, dest):
 		mat[13] = a13
 		mat[14] = a23
 		
+		if (type(mat) is Mat4):
+			mat.kind = MAT4_GENERAL
+		
 		return mat
 	
 	dest[0] = mat[0]
@@ -520,6 +586,9 @@ def mat4_transpose(mat, dest):
 	dest[14] = mat[11]
 	dest[15] = mat[15]
 	
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_GENERAL
+	
 	return dest
 
 def mat4_determinant(mat):
@@ -555,9 +624,32 @@ def mat4_determinant(mat):
 			a20 * a01 * a12 * a33 - a00 * a21 * a12 * a33 -
 			a10 * a01 * a22 * a33 + a00 * a11 * a22 * a33)
 
+# Kinds of matrices, carried by Mat4.kind. Inverting a Mat4 flagged as affine or
+# rigid goes through the matching fast path instead of the general inverse. The
+# mat4 functions that build or combine matrices keep the kind of a Mat4 dest up
+# to date, so only values written by hand need flagging.
+MAT4_GENERAL = 0
+MAT4_AFFINE = 1		# Bottom row is 0 0 0 1
+MAT4_RIGID = 2		# Rotation and translation only
+
+# Kind of any matrix, plain lists and arrays count as general
+def _mat4_kind(mat):
+
+	if (type(mat) is Mat4):
+		return mat.kind
+	
+	return MAT4_GENERAL
+
 def mat4_inverse(mat, dest):
 
-	if (None==dest):
+	# Exact type test, so plain lists pay no more than one compare
+	if (type(mat) is Mat4) and (MAT4_GENERAL != mat.kind):
+		if (MAT4_RIGID == mat.kind):
+			return mat4_inverse_rigid(mat, dest)
+		
+		return mat4_inverse_affine(mat, dest)
+	
+	if (dest is None):
 	
 		dest = mat
 	
@@ -593,7 +685,7 @@ def mat4_inverse(mat, dest):
 	d =	(b00 * b11 - b01 * b10 + b02 * b09 + b03 * b08 - b04 * b07 + b05 * b06)
 
 	#Calculate the determinant
-	if (None==d):
+	if (0 == d):
 	
 		return None
 	
@@ -616,11 +708,116 @@ def mat4_inverse(mat, dest):
 	dest[14] = (-a30 * b03 + a31 * b01 - a32 * b00) * invDet
 	dest[15] = (a20 * b03 - a21 * b01 + a22 * b00) * invDet
 
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_GENERAL
+	
+	return dest
+
+# Inverse of an affine matrix, one whose bottom row is 0 0 0 1. Only the upper 3x3
+# part goes through a general inverse. Returns None if it is singular.
+def mat4_inverse_affine(mat, dest):
+
+	if (dest is None):
+		dest = mat
+	
+	a00 = mat[0]
+	a01 = mat[1]
+	a02 = mat[2]
+	a10 = mat[4]
+	a11 = mat[5]
+	a12 = mat[6]
+	a20 = mat[8]
+	a21 = mat[9]
+	a22 = mat[10]
+	tx = mat[12]
+	ty = mat[13]
+	tz = mat[14]
+	b01 = a22 * a11 - a12 * a21
+	b11 = -a22 * a10 + a12 * a20
+	b21 = a21 * a10 - a11 * a20
+	d = a00 * b01 + a01 * b11 + a02 * b21
+
+	if (0 == d):
+		return None
+	
+	id = 1 / d
+	r0 = b01 * id
+	r1 = (-a22 * a01 + a02 * a21) * id
+	r2 = (a12 * a01 - a02 * a11) * id
+	r3 = b11 * id
+	r4 = (a22 * a00 - a02 * a20) * id
+	r5 = (-a12 * a00 + a02 * a10) * id
+	r6 = b21 * id
+	r7 = (-a21 * a00 + a01 * a20) * id
+	r8 = (a11 * a00 - a01 * a10) * id
+
+	dest[0] = r0
+	dest[1] = r1
+	dest[2] = r2
+	dest[3] = 0
+	dest[4] = r3
+	dest[5] = r4
+	dest[6] = r5
+	dest[7] = 0
+	dest[8] = r6
+	dest[9] = r7
+	dest[10] = r8
+	dest[11] = 0
+	dest[12] = -(r0 * tx + r3 * ty + r6 * tz)
+	dest[13] = -(r1 * tx + r4 * ty + r7 * tz)
+	dest[14] = -(r2 * tx + r5 * ty + r8 * tz)
+	dest[15] = 1
+
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_AFFINE
+	
+	return dest
+
+# Inverse of a rigid matrix, rotation and translation only : the rotation part is
+# transposed and the negated translation rotated by it.
+def mat4_inverse_rigid(mat, dest):
+
+	if (dest is None):
+		dest = mat
+	
+	a00 = mat[0]
+	a01 = mat[1]
+	a02 = mat[2]
+	a10 = mat[4]
+	a11 = mat[5]
+	a12 = mat[6]
+	a20 = mat[8]
+	a21 = mat[9]
+	a22 = mat[10]
+	tx = mat[12]
+	ty = mat[13]
+	tz = mat[14]
+
+	dest[0] = a00
+	dest[1] = a10
+	dest[2] = a20
+	dest[3] = 0
+	dest[4] = a01
+	dest[5] = a11
+	dest[6] = a21
+	dest[7] = 0
+	dest[8] = a02
+	dest[9] = a12
+	dest[10] = a22
+	dest[11] = 0
+	dest[12] = -(a00 * tx + a01 * ty + a02 * tz)
+	dest[13] = -(a10 * tx + a11 * ty + a12 * tz)
+	dest[14] = -(a20 * tx + a21 * ty + a22 * tz)
+	dest[15] = 1
+
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_RIGID
+	
 	return dest
 
 def mat4_toRotationMat(mat, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat4_create(None)
 
 	dest[0] = mat[0]
@@ -640,11 +837,14 @@ def mat4_toRotationMat(mat, dest):
 	dest[14] = 0
 	dest[15] = 1
 
+	if (type(dest) is Mat4):
+		dest.kind = _mat4_kind(mat)
+	
 	return dest
 
 def mat4_toMat3(mat, dest):
 
-	if (None==dest):
+	if (dest is None):
 	
 		dest = mat3_create(None)
 	
@@ -678,12 +878,12 @@ def mat4_toInverseMat3(mat, dest):
 	b21 = a21 * a10 - a11 * a20
 	d = a00 * b01 + a01 * b11 + a02 * b21
 
-	if (None==d):
+	if (0 == d):
 		return None
 	
 	id = 1 / d
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat3_create(None)
 	
 	dest[0] = b01 * id
@@ -700,7 +900,7 @@ def mat4_toInverseMat3(mat, dest):
 
 def mat4_multiply(mat, mat2, dest=None):
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat
 	
 	#Cache the matrix values (makes for huge speed increases!)
@@ -758,11 +958,14 @@ def mat4_multiply(mat, mat2, dest=None):
 	dest[14] = b30 * a02 + b31 * a12 + b32 * a22 + b33 * a32
 	dest[15] = b30 * a03 + b31 * a13 + b32 * a23 + b33 * a33
 
+	if (type(dest) is Mat4):
+		dest.kind = min(_mat4_kind(mat), _mat4_kind(mat2))
+	
 	return dest
 
 def mat4_multiplyVec3(mat, vec, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = vec
 	
 	x = vec[0]
@@ -777,7 +980,7 @@ def mat4_multiplyVec3(mat, vec, dest):
 
 def mat4_multiplyVec4(mat, vec, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = vec
 	
 	x = vec[0] 
@@ -798,7 +1001,7 @@ def mat4_translate(mat, vec, dest):
 	y = vec[1]
 	z = vec[2]
 
-	if (None==dest or mat == dest):
+	if (dest is None or mat is dest):
 	
 		mat[12] = mat[0] * x + mat[4] * y + mat[8] * z + mat[12]
 		mat[13] = mat[1] * x + mat[5] * y + mat[9] * z + mat[13]
@@ -838,6 +1041,9 @@ def mat4_translate(mat, vec, dest):
 	dest[14] = a02 * x + a12 * y + a22 * z + mat[14]
 	dest[15] = a03 * x + a13 * y + a23 * z + mat[15]
 	
+	if (type(dest) is Mat4):
+		dest.kind = _mat4_kind(mat)
+	
 	return dest
 
 def mat4_scale(mat, vec, dest):
@@ -846,7 +1052,7 @@ def mat4_scale(mat, vec, dest):
 	y = vec[1]
 	z = vec[2]
 
-	if (None==dest or mat == dest):
+	if (dest is None or mat is dest):
 	
 		mat[0]  = mat[0]  * x
 		mat[1]  = mat[1]  * x
@@ -861,6 +1067,9 @@ def mat4_scale(mat, vec, dest):
 		mat[10] = mat[10] * z
 		mat[11] = mat[11] * z
 		
+		if (type(mat) is Mat4):
+			mat.kind = min(mat.kind, MAT4_AFFINE)
+		
 		return mat
 	
 	dest[0] = mat[0] * x
@@ -880,6 +1089,9 @@ def mat4_scale(mat, vec, dest):
 	dest[14] = mat[14]
 	dest[15] = mat[15]
 	
+	if (type(dest) is Mat4):
+		dest.kind = min(_mat4_kind(mat), MAT4_AFFINE)
+	
 	return dest
 
 def mat4_rotate(mat, angle, axis, dest):
@@ -928,10 +1140,10 @@ def mat4_rotate(mat, angle, axis, dest):
 	b21 = y * z * t - x * s
 	b22 = z * z * t + c
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat
 	
-	elif (mat != dest):  	#If the source and destination differ, copy the unchanged last row
+	elif (mat is not dest):  	#If the source and destination differ, copy the unchanged last row
 		dest[12] = mat[12]
 		dest[13] = mat[13]
 		dest[14] = mat[14]
@@ -953,6 +1165,9 @@ def mat4_rotate(mat, angle, axis, dest):
 	dest[10] = a02 * b20 + a12 * b21 + a22 * b22
 	dest[11] = a03 * b20 + a13 * b21 + a23 * b22
 	
+	if (type(dest) is Mat4):
+		dest.kind = _mat4_kind(mat)
+	
 	return dest
 
 def mat4_rotateX(mat, angle, dest):
@@ -968,10 +1183,10 @@ def mat4_rotateX(mat, angle, dest):
 	a22 = mat[10]
 	a23 = mat[11]
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat
 	
-	elif (mat != dest):  	#If the source and destination differ, copy the unchanged rows
+	elif (mat is not dest):  	#If the source and destination differ, copy the unchanged rows
 	
 		dest[0] = mat[0]
 		dest[1] = mat[1]
@@ -993,6 +1208,9 @@ def mat4_rotateX(mat, angle, dest):
 	dest[9] = a11 * -s + a21 * c
 	dest[10] = a12 * -s + a22 * c
 	dest[11] = a13 * -s + a23 * c
+	if (type(dest) is Mat4):
+		dest.kind = _mat4_kind(mat)
+	
 	return dest
 
 def mat4_rotateY(mat, angle, dest):
@@ -1008,10 +1226,10 @@ def mat4_rotateY(mat, angle, dest):
 	a22 = mat[10]
 	a23 = mat[11]
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat
 	
-	elif (mat != dest):  	#If the source and destination differ, copy the unchanged rows
+	elif (mat is not dest):  	#If the source and destination differ, copy the unchanged rows
 	
 		dest[4] = mat[4]
 		dest[5] = mat[5]
@@ -1034,6 +1252,9 @@ def mat4_rotateY(mat, angle, dest):
 	dest[10] = a02 * s + a22 * c
 	dest[11] = a03 * s + a23 * c
 	
+	if (type(dest) is Mat4):
+		dest.kind = _mat4_kind(mat)
+	
 	return dest
 
 def mat4_rotateZ(mat, angle, dest):
@@ -1048,10 +1269,10 @@ def mat4_rotateZ(mat, angle, dest):
 	a12 = mat[6] 
 	a13 = mat[7]
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat
 	
-	elif (mat != dest):  	#If the source and destination differ, copy the unchanged last row
+	elif (mat is not dest):  	#If the source and destination differ, copy the unchanged last row
 		dest[8] = mat[8]
 		dest[9] = mat[9]
 		dest[10] = mat[10]
@@ -1073,11 +1294,14 @@ def mat4_rotateZ(mat, angle, dest):
 	dest[6] = a02 * -s + a12 * c
 	dest[7] = a03 * -s + a13 * c
 
+	if (type(dest) is Mat4):
+		dest.kind = _mat4_kind(mat)
+	
 	return dest
 
 def mat4_frustum(left, right, bottom, top, near, far, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat4_create(None)
 	
 	rl = (right - left) 
@@ -1101,6 +1325,9 @@ def mat4_frustum(left, right, bottom, top, near, far, dest):
 	dest[14] = -(far * near * 2) / fn
 	dest[15] = 0
 	
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_GENERAL
+	
 	return dest
 
 def mat4_perspective(fovy, aspect, near, far, dest):
@@ -1112,7 +1339,7 @@ def mat4_perspective(fovy, aspect, near, far, dest):
 
 def mat4_ortho(left, right, bottom, top, near, far, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat4_create(None)
 	
 	rl = (right - left) 
@@ -1136,6 +1363,9 @@ def mat4_ortho(left, right, bottom, top, near, far, dest):
 	dest[14] = -(far + near) / fn
 	dest[15] = 1
 	
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_AFFINE
+	
 	return dest
 
 def mat4_ortho_GetExtent(dest):
@@ -1145,7 +1375,7 @@ def mat4_ortho_GetExtent(dest):
 	bottom = 0.0
 	top = 0.0
 		
-	if None != dest :
+	if dest is not None :
 		right = (1.0 - dest[12])/dest[0]
 		
 		left = right - (2.0/dest[0])
@@ -1162,7 +1392,7 @@ def mat4_ortho_GetExtent(dest):
 	
 def mat4_lookAt(eye, center, up, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat4_create(None)
 	
 	eyex = eye[0]
@@ -1241,11 +1471,14 @@ def mat4_lookAt(eye, center, up, dest):
 	dest[14] = -(z0 * eyex + z1 * eyey + z2 * eyez)
 	dest[15] = 1
 
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_RIGID
+	
 	return dest
 
 def mat4_fromRotationTranslation(quat, vec, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat4_create(None)
 	
 	#Quaternion math
@@ -1283,6 +1516,59 @@ def mat4_fromRotationTranslation(quat, vec, dest):
 	dest[14] = vec[2]
 	dest[15] = 1
 
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_RIGID
+	
+	return dest
+
+# Model matrix translate * rotate * scale in one pass, the same as
+# mat4_fromRotationTranslation followed by mat4_scale
+def mat4_fromRotationTranslationScale(quat, vec, scale, dest):
+
+	if (dest is None):
+		dest = mat4_create(None)
+	
+	#Quaternion math
+	x = quat[0] 
+	y = quat[1] 
+	z = quat[2] 
+	w = quat[3]
+	x2 = x + x
+	y2 = y + y
+	z2 = z + z
+	xx = x * x2
+	xy = x * y2
+	xz = x * z2
+	yy = y * y2
+	yz = y * z2 
+	zz = z * z2 
+	wx = w * x2 
+	wy = w * y2 
+	wz = w * z2
+	sx = scale[0]
+	sy = scale[1]
+	sz = scale[2]
+
+	dest[0] = (1 - (yy + zz)) * sx
+	dest[1] = (xy + wz) * sx
+	dest[2] = (xz - wy) * sx
+	dest[3] = 0
+	dest[4] = (xy - wz) * sy
+	dest[5] = (1 - (xx + zz)) * sy
+	dest[6] = (yz + wx) * sy
+	dest[7] = 0
+	dest[8] = (xz + wy) * sz
+	dest[9] = (yz - wx) * sz
+	dest[10] = (1 - (xx + yy)) * sz
+	dest[11] = 0
+	dest[12] = vec[0]
+	dest[13] = vec[1]
+	dest[14] = vec[2]
+	dest[15] = 1
+
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_AFFINE
+	
 	return dest
 
 ################################################################################
@@ -1314,7 +1600,7 @@ def quat_calculateW(quat, dest):
 	y = quat[1]
 	z = quat[2]
 
-	if (None==dest or quat == dest):
+	if (dest is None or quat is dest):
 		quat[3] = -sqrt(fabs(1.0 - x * x - y * y - z * z))
 		
 		return quat
@@ -1336,7 +1622,7 @@ def quat_inverse(quat, dest):
 	
 	invDot = 1.0 / dot
 	
-	if (None==dest or quat == dest):
+	if (dest is None or quat is dest):
 	
 		quat[0] = quat[0] * -invDot
 		quat[1] = quat[1] * -invDot
@@ -1354,7 +1640,7 @@ def quat_inverse(quat, dest):
 
 def quat_conjugate(quat, dest):
 
-	if (None==dest or quat == dest):
+	if (dest is None or quat is dest):
 	
 		quat[0] = quat[0] * -1
 		quat[1] = quat[1] * -1
@@ -1391,7 +1677,7 @@ def quat_length(quat):
 #
 def quat_normalize(quat, dest):
 
-	if (None == dest):
+	if (dest is None):
 		dest = quat
 	
 	x = quat[0]
@@ -1420,7 +1706,7 @@ def quat_normalize(quat, dest):
 
 def quat_multiply(quat, quat2, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = quat
 	
 	qax = quat[0] 
@@ -1441,7 +1727,7 @@ def quat_multiply(quat, quat2, dest):
 
 def quat_multiplyVec3(quat, vec, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = vec
 	
 	x = vec[0]
@@ -1466,7 +1752,7 @@ def quat_multiplyVec3(quat, vec, dest):
 
 def quat_toMat3(quat, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat3_create(None)
 	
 	x = quat[0] 
@@ -1502,7 +1788,7 @@ def quat_toMat3(quat, dest):
 
 def quat_toMat4_do_not_use_directly(quat, dest):
 
-	if (None==dest):
+	if (dest is None):
 		dest = mat4_create(None)
 	
 	x = quat[0]
@@ -1546,11 +1832,14 @@ def quat_toMat4_do_not_use_directly(quat, dest):
 	dest[14] = 0
 	dest[15] = 1
 
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_RIGID
+	
 	return dest
 
 def quat_slerp(quat, quat2, slerp, dest):
 
-	if (None==dest):
+	if (dest is None):
 	
 		dest = quat
 	
@@ -1558,7 +1847,7 @@ def quat_slerp(quat, quat2, slerp, dest):
 
 	if (fabs(cosHalfTheta) >= 1.0):
 	
-		if (dest != quat):
+		if (dest is not quat):
 		
 			dest[0] = quat[0]
 			dest[1] = quat[1]
@@ -1803,13 +2092,7 @@ def mat4_decompose(iMat):
 
 # Given an axis and angle, compute quaternion.
 def axis_to_quat(a, phi, q):
-	normalised_a = vec3_create(None)
-	vec3_normalize(a, normalised_a)
-	
-	q[0] = normalised_a[0]
-	q[1] = normalised_a[1]
-	q[2] = normalised_a[2]
-	
+	vec3_normalize(a, q)
 	vec3_scale(q, sin(phi/2.0), None)
 	
 	q[3] = cos(phi/2.0)
@@ -1839,40 +2122,32 @@ def tb_project_to_sphere(r, x, y):
 # NOTE: This routine is written so that q1 or q2 may be the same
 # as dest (or each other).
 # 
+# Returns the updated renormcounter; pass it back in on the next call.
+# 
 RENORMCOUNT=97
-def add_quats(q1, q2, dest, renormcounter):    
-    t1 = quat_create(q1) 
-    t2 = quat_create(q2)  
-    t3 = quat_create(None) 
-    tf = quat_create(None) 
-    
-    # Note: using vec3 fxn on quat
-    vec3_scale(t1, q2[3], None)
-    
-    # Note: using vec3 fxn on quat
-    vec3_scale(t2, q1[3], None)
-    
-    # Note: using vec3 fxn on quat
-    vec3_cross(q2, q1, t3)
-    
-    # Note: using vec3 fxn on quat
-    vec3_add(t1, t2, tf)
-    
-    # Note: using vec3 fxn on quat
-    vec3_add(t3, tf, tf)
-    
-    d1_dot_q2_using_vec3_dot = vec3_dot(q1, q2)
-    tf[3] = q1[3] * q2[3] - d1_dot_q2_using_vec3_dot
-
-    dest[0] = tf[0]
-    dest[1] = tf[1]
-    dest[2] = tf[2]
-    dest[3] = tf[3]
-
-    if (++renormcounter > RENORMCOUNT):
-        renormcounter = 0
-        quat_normalize(dest, None)
-   
+def add_quats(q1, q2, dest, renormcounter):
+	x1 = q1[0]
+	y1 = q1[1]
+	z1 = q1[2]
+	w1 = q1[3]
+	x2 = q2[0]
+	y2 = q2[1]
+	z2 = q2[2]
+	w2 = q2[3]
+	
+	# t1 * w2 + t2 * w1 + cross(q2, q1), done on the vector parts
+	dest[0] = x1 * w2 + x2 * w1 + (y2 * z1 - z2 * y1)
+	dest[1] = y1 * w2 + y2 * w1 + (z2 * x1 - x2 * z1)
+	dest[2] = z1 * w2 + z2 * w1 + (x2 * y1 - y2 * x1)
+	dest[3] = w1 * w2 - (x1 * x2 + y1 * y2 + z1 * z2)
+
+	renormcounter += 1
+	
+	if (renormcounter > RENORMCOUNT):
+		renormcounter = 0
+		quat_normalize(dest, None)
+	
+	return renormcounter
 
 # This size should really be based on the distance from the center of
 # rotation to the point on the object underneath the mouse.  That
@@ -1894,13 +2169,10 @@ TRACKBALLSIZE=0.8
 # 
 
 def trackball(q, p1x, p1y, p2x, p2y):
-	p1 = vec3_create(None) 
-	p2 = vec3_create(None)
-	
-	# Axis of rotation 
-	a = vec3_create(None) 
-	d = vec3_create(None)
+	_tb_spin(q, TRACKBALLSIZE, p1x, p1y, p2x, p2y)
 
+# trackball() for a ball of the given size, on plain floats only
+def _tb_spin(q, size, p1x, p1y, p2x, p2y):
 	if (p1x == p2x) and (p1y == p2y) :
 		# Zero rotation 
 		q[0] = 0.0
@@ -1912,20 +2184,19 @@ def trackball(q, p1x, p1y, p2x, p2y):
 
 	# First, figure out z-coordinates for projection of P1 and P2 to
 	# deformed sphere 
-	p1[0] = p1x
-	p1[1] = p1y 
-	p1[2] = tb_project_to_sphere(TRACKBALLSIZE, p1x, p1y)
-
-	p2[0] = p2x 
-	p2[1] = p2y 
-	p2[2] = tb_project_to_sphere(TRACKBALLSIZE, p2x, p2y)
+	p1z = tb_project_to_sphere(size, p1x, p1y)
+	p2z = tb_project_to_sphere(size, p2x, p2y)
 
 	# Now, we want the cross product of P1 and P2
-	vec3_cross(p2, p1, a)
+	ax = p2y * p1z - p2z * p1y
+	ay = p2z * p1x - p2x * p1z
+	az = p2x * p1y - p2y * p1x
 
 	# Figure out how much to rotate around that axis.
-	vec3_subtract(p1, p2, d)
-	t = vec3_length(d) / (2.0*TRACKBALLSIZE)
+	dx = p1x - p2x
+	dy = p1y - p2y
+	dz = p1z - p2z
+	t = sqrt(dx * dx + dy * dy + dz * dz) / (2.0*size)
 
 	# Avoid problems with out-of-control values...
 	if t > 1.0 :
@@ -1937,7 +2208,75 @@ def trackball(q, p1x, p1y, p2x, p2y):
 	# how much to rotate about axis
 	phi = 2.0 * asin(t)
 
-	axis_to_quat(a, phi, q)
+	# axis_to_quat, with a zero axis giving no rotation
+	aLen = sqrt(ax * ax + ay * ay + az * az)
+	
+	if (0 == aLen):
+		q[0] = 0.0
+		q[1] = 0.0
+		q[2] = 0.0
+		q[3] = 1.0
+		
+		return
+	
+	s = sin(phi/2.0) / aLen
+	q[0] = ax * s
+	q[1] = ay * s
+	q[2] = az * s
+	q[3] = cos(phi/2.0)
+
+# Trackball session : keeps the accumulated rotation and the scratch
+# quaternions, so pointer events cost no allocations. A burst of queued
+# pointer positions is folded into one spin and composed with the rotation
+# once. add_quats renormalizes the result every RENORMCOUNT compositions.
+class Trackball:
+	def __init__(self, size=TRACKBALLSIZE):
+		self.size = size
+		self.counter = 0
+		self.rotation = [0.0, 0.0, 0.0, 1.0]
+		self.spin = [0.0, 0.0, 0.0, 1.0]
+		self.burst = [0.0, 0.0, 0.0, 1.0]
+		self.origin = [0.0, 0.0, 0.0]
+	
+	def reset(self):
+		self.counter = 0
+		self.rotation[0:4] = [0.0, 0.0, 0.0, 1.0]
+	
+	# One pointer move from (p1x, p1y) to (p2x, p2y), in the -1.0 ... 1.0 range
+	def drag(self, p1x, p1y, p2x, p2y):
+		_tb_spin(self.spin, self.size, p1x, p1y, p2x, p2y)
+		self.counter = add_quats(self.spin, self.rotation, self.rotation, self.counter)
+		
+		return self.rotation
+	
+	# A burst of pointer positions, packed as x0, y0, x1, y1, ... : every move
+	# between consecutive positions is folded into one spin, which is then
+	# composed with the rotation once. With coalesce True the burst is taken as
+	# a single move from its first to its last position.
+	def drags(self, points, coalesce=False):
+		n = len(points) // 2
+		
+		if (n < 2):
+			return self.rotation
+		
+		if coalesce:
+			return self.drag(points[0], points[1], points[n * 2 - 2], points[n * 2 - 1])
+		
+		burst = self.burst
+		spin = self.spin
+		burst[0:4] = [0.0, 0.0, 0.0, 1.0]
+		counter = 0
+		
+		for i in range(0, n * 2 - 2, 2):
+			_tb_spin(spin, self.size, points[i], points[i + 1], points[i + 2], points[i + 3])
+			counter = add_quats(spin, burst, burst, counter)
+		
+		self.counter = add_quats(burst, self.rotation, self.rotation, self.counter)
+		
+		return self.rotation
+	
+	def matrix(self, dest=None):
+		return mat4_fromRotationTranslation(self.rotation, self.origin, dest)
 
 ################################################################################
 
@@ -2013,3 +2352,2806 @@ class matstack:
 		if 0 < self.size() :
 			m_Top = self.peek()
 			mat4_set(m_Top, m)
+
+# Matrix stack with a fixed depth, backed by one preallocated contiguous buffer.
+#
+# Entries are slots in the buffer : push copies into the next slot, pop just moves
+# the top index down, and multMatrix goes through a reserved scratch slot. Once
+# created, traversal does not allocate. Matrices returned by peek and pop are
+# views into the buffer, valid until that slot is pushed over again.
+
+class fixedmatstack(matstack):
+	def __init__(self, depth=32):
+		self.depth = depth
+		self.top = 0
+		self.data = array('d', bytes((depth + 1) * 16 * 8))
+		
+		buf = memoryview(self.data)
+		self.slots = [buf[i * 16:i * 16 + 16] for i in range(depth + 1)]
+		self.scratch = self.slots[depth]
+	
+	def isEmpty(self):
+		return 0 == self.top
+	
+	def push(self, item):
+		if self.top < self.depth :
+			mat4_set(item, self.slots[self.top])
+			self.top += 1
+		
+		else:
+			print("Expected stack push exceeds the fixed depth.")
+	
+	def pop(self):
+		if 0 < self.top :
+			self.top -= 1
+			return self.slots[self.top]
+		
+		else:
+			print("Expected stack pop is already empty.")
+	
+	def peek(self):
+		if 0 < self.top :
+			return self.slots[self.top - 1]
+		else:
+			return None
+	
+	def size(self):
+		return self.top
+	
+	##############################################################################
+	
+	def loadMatrix(self, m):
+		self.push(m)
+	
+	def unload(self):
+		self.top = 0
+	
+	def loadIdentityMatrix(self):
+		if self.top < self.depth :
+			mat4_identity(self.slots[self.top])
+			self.top += 1
+		
+		else:
+			print("Expected stack push exceeds the fixed depth.")
+	
+	def multMatrix(self, m):
+		if 0 < self.top :
+			m_Top = self.slots[self.top - 1]
+			gl_mat4_multiply(m, m_Top, self.scratch)
+			mat4_set(self.scratch, m_Top)
+
+################################################################################
+
+# Batched operations
+#
+# Batched functions work on N packed values stored back to back in one
+# contiguous buffer : N*16 floats for mat4, N*4 for vec4/quat, N*3 for vec3.
+# Accepted buffers are NumPy arrays of shape (N, 16) or (N*16,), array('f') or
+# array('d'), memoryviews and flat lists.
+#
+# When NumPy is available, buffers are viewed without copying and all N items
+# are processed in a single vectorized call. Otherwise (or when the output is a
+# plain list) the same math runs in a Python loop over the flat buffer.
+#
+# An input holding a single item is broadcast against the other inputs.
+
+def _batch_use_numpy(dest):
+	return (np is not None) and not isinstance(dest, list)
+
+# (N, width) view of a buffer, copying only when the input is not a buffer.
+def _batch_view(buf, width):
+	return np.asarray(buf).reshape(-1, width)
+
+# (N, width) view of an output buffer; results must land in the caller's memory.
+def _batch_out_view(buf, width):
+	view = np.asarray(buf)
+	
+	if not view.flags.c_contiguous or not view.flags.writeable:
+		raise ValueError("batched output must be a writable contiguous buffer")
+	
+	return view.reshape(-1, width)
+
+# One-dimensional indexable version of a buffer for the pure Python path.
+def _batch_flat(buf):
+	if isinstance(buf, memoryview) and buf.ndim != 1:
+		return buf.cast('B').cast(buf.format)
+	
+	if (np is not None) and isinstance(buf, np.ndarray):
+		return buf.reshape(-1)
+	
+	return buf
+
+# Batch functions do not track what they write, so a Mat4 used as output is
+# flagged general, or with kind when every result is of that kind by construction
+def _batch_kind(out, kind=MAT4_GENERAL):
+	if (type(out) is Mat4):
+		out.kind = kind
+
+def _batch_count(flat, width):
+	n = len(flat) // width
+	
+	if n * width != len(flat):
+		raise ValueError("buffer length is not a multiple of %d" % width)
+	
+	return n
+
+# Number of results for inputs holding the given item counts. Inputs holding a
+# single item are broadcast, all others have to hold the same count.
+def _batch_broadcast(*counts):
+	n = max(counts)
+	
+	for count in counts:
+		if (count != n) and (count != 1):
+			raise ValueError("batched inputs hold %s items, counts must match or be 1" % ", ".join([str(c) for c in counts]))
+	
+	return n
+
+# Multiplies N pairs of matrices, out[i] = A[i] * B[i], using the same column-major
+# convention as mat4_multiply. If out is None, the result is written into A.
+def mat4_multiply_batch(A, B, out=None):
+
+	if (out is None):
+		out = A
+	
+	_batch_kind(out)
+	
+	if _batch_use_numpy(out):
+		a = _batch_view(A, 16).reshape(-1, 4, 4)
+		b = _batch_view(B, 16).reshape(-1, 4, 4)
+		o = _batch_out_view(out, 16).reshape(-1, 4, 4)
+		
+		# Row-major views of column-major data hold the transposes, so A*B is B'A'
+		np.matmul(b, a, out=o)
+		
+		return out
+	
+	fa = _batch_flat(A)
+	fb = _batch_flat(B)
+	fo = _batch_flat(out)
+	na = _batch_count(fa, 16)
+	nb = _batch_count(fb, 16)
+	n = _batch_broadcast(na, nb)
+	sa = 16 if na > 1 else 0
+	sb = 16 if nb > 1 else 0
+	
+	oa = 0
+	ob = 0
+	o = 0
+	for i in range(n):
+		a00, a01, a02, a03, a10, a11, a12, a13, a20, a21, a22, a23, a30, a31, a32, a33 = fa[oa:oa + 16]
+		b00, b01, b02, b03, b10, b11, b12, b13, b20, b21, b22, b23, b30, b31, b32, b33 = fb[ob:ob + 16]
+		
+		fo[o]      = b00 * a00 + b01 * a10 + b02 * a20 + b03 * a30
+		fo[o + 1]  = b00 * a01 + b01 * a11 + b02 * a21 + b03 * a31
+		fo[o + 2]  = b00 * a02 + b01 * a12 + b02 * a22 + b03 * a32
+		fo[o + 3]  = b00 * a03 + b01 * a13 + b02 * a23 + b03 * a33
+		
+		fo[o + 4]  = b10 * a00 + b11 * a10 + b12 * a20 + b13 * a30
+		fo[o + 5]  = b10 * a01 + b11 * a11 + b12 * a21 + b13 * a31
+		fo[o + 6]  = b10 * a02 + b11 * a12 + b12 * a22 + b13 * a32
+		fo[o + 7]  = b10 * a03 + b11 * a13 + b12 * a23 + b13 * a33
+		
+		fo[o + 8]  = b20 * a00 + b21 * a10 + b22 * a20 + b23 * a30
+		fo[o + 9]  = b20 * a01 + b21 * a11 + b22 * a21 + b23 * a31
+		fo[o + 10] = b20 * a02 + b21 * a12 + b22 * a22 + b23 * a32
+		fo[o + 11] = b20 * a03 + b21 * a13 + b22 * a23 + b23 * a33
+		
+		fo[o + 12] = b30 * a00 + b31 * a10 + b32 * a20 + b33 * a30
+		fo[o + 13] = b30 * a01 + b31 * a11 + b32 * a21 + b33 * a31
+		fo[o + 14] = b30 * a02 + b31 * a12 + b32 * a22 + b33 * a32
+		fo[o + 15] = b30 * a03 + b31 * a13 + b32 * a23 + b33 * a33
+		
+		oa += sa
+		ob += sb
+		o += 16
+	
+	return out
+
+# Transforms N packed vec3 by one matrix, like mat4_multiplyVec3. With divide set,
+# the w row is computed as well and the result gets the perspective divide.
+# If dest is None, vecs is transformed in place.
+def mat4_multiplyVec3_batch(mat, vecs, dest=None, divide=False):
+
+	if (dest is None):
+		dest = vecs
+	
+	_batch_kind(dest)
+	
+	if _batch_use_numpy(dest):
+		m = np.asarray(mat).reshape(4, 4)
+		v = _batch_view(vecs, 3)
+		o = _batch_out_view(dest, 3)
+		
+		r = v @ m[:3, :3] + m[3, :3]
+		
+		if divide:
+			r /= (v @ m[:3, 3] + m[3, 3])[:, None]
+		
+		o[...] = r
+		
+		return dest
+	
+	m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11, m12, m13, m14, m15 = mat[0:16]
+	fv = _batch_flat(vecs)
+	fo = _batch_flat(dest)
+	n = _batch_count(fv, 3)
+	
+	o = 0
+	for i in range(n):
+		x, y, z = fv[o:o + 3]
+		
+		rx = m0 * x + m4 * y + m8 * z + m12
+		ry = m1 * x + m5 * y + m9 * z + m13
+		rz = m2 * x + m6 * y + m10 * z + m14
+		
+		if divide:
+			w = 1 / (m3 * x + m7 * y + m11 * z + m15)
+			rx = rx * w
+			ry = ry * w
+			rz = rz * w
+		
+		fo[o] = rx
+		fo[o + 1] = ry
+		fo[o + 2] = rz
+		
+		o += 3
+	
+	return dest
+
+# Transforms N packed vec4 by one matrix, like mat4_multiplyVec4. With divide set,
+# x, y and z are divided by the resulting w, which is kept as is.
+# If dest is None, vecs is transformed in place.
+def mat4_multiplyVec4_batch(mat, vecs, dest=None, divide=False):
+
+	if (dest is None):
+		dest = vecs
+	
+	_batch_kind(dest)
+	
+	if _batch_use_numpy(dest):
+		m = np.asarray(mat).reshape(4, 4)
+		v = _batch_view(vecs, 4)
+		o = _batch_out_view(dest, 4)
+		
+		r = v @ m
+		
+		if divide:
+			r[:, :3] /= r[:, 3:]
+		
+		o[...] = r
+		
+		return dest
+	
+	m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11, m12, m13, m14, m15 = mat[0:16]
+	fv = _batch_flat(vecs)
+	fo = _batch_flat(dest)
+	n = _batch_count(fv, 4)
+	
+	o = 0
+	for i in range(n):
+		x, y, z, w = fv[o:o + 4]
+		
+		rx = m0 * x + m4 * y + m8 * z + m12 * w
+		ry = m1 * x + m5 * y + m9 * z + m13 * w
+		rz = m2 * x + m6 * y + m10 * z + m14 * w
+		rw = m3 * x + m7 * y + m11 * z + m15 * w
+		
+		if divide:
+			iw = 1 / rw
+			rx = rx * iw
+			ry = ry * iw
+			rz = rz * iw
+		
+		fo[o] = rx
+		fo[o + 1] = ry
+		fo[o + 2] = rz
+		fo[o + 3] = rw
+		
+		o += 4
+	
+	return dest
+
+# Spherical interpolation of N quaternion pairs, like quat_slerp. t is a single
+# value or one value per pair. Unlike quat_slerp, the shorter arc is always taken
+# (q1 is negated when the pair is more than 180 degrees apart). The small angle
+# fallback to the halfway quaternion is the same as in quat_slerp.
+# If out is None, the result is written into q0.
+def quat_slerp_batch(q0, q1, t, out=None):
+
+	if (out is None):
+		out = q0
+	
+	_batch_kind(out)
+	
+	if _batch_use_numpy(out):
+		a = _batch_view(q0, 4)
+		b = _batch_view(q1, 4)
+		o = _batch_out_view(out, 4)
+		t = np.asarray(t, dtype=np.float64).reshape(-1)
+		
+		cosHalfTheta = (a * b).sum(axis=1)
+		b = np.where((cosHalfTheta < 0.0)[:, None], -b, b)
+		cosHalfTheta = np.minimum(np.fabs(cosHalfTheta), 1.0)
+		
+		halfTheta = np.arccos(cosHalfTheta)
+		sinHalfTheta = np.sqrt(1.0 - cosHalfTheta * cosHalfTheta)
+		small = np.fabs(sinHalfTheta) < 0.001
+		sinHalfTheta[small] = 1.0
+		
+		ratioA = np.where(small, 0.5, np.sin((1 - t) * halfTheta) / sinHalfTheta)
+		ratioB = np.where(small, 0.5, np.sin(t * halfTheta) / sinHalfTheta)
+		
+		same = cosHalfTheta >= 1.0
+		ratioA[same] = 1.0
+		ratioB[same] = 0.0
+		
+		o[...] = a * ratioA[:, None] + b * ratioB[:, None]
+		
+		return out
+	
+	fa = _batch_flat(q0)
+	fb = _batch_flat(q1)
+	fo = _batch_flat(out)
+	na = _batch_count(fa, 4)
+	nb = _batch_count(fb, 4)
+	n = _batch_broadcast(na, nb)
+	sa = 4 if na > 1 else 0
+	sb = 4 if nb > 1 else 0
+	
+	# Any real scalar, NumPy scalars included, is one t for every pair
+	if isinstance(t, numbers.Real):
+		ft = None
+		slerp = t
+	
+	else:
+		ft = _batch_flat(t)
+		st = 1 if len(ft) > 1 else 0
+		
+		if (len(ft) != 1) and (len(ft) != n):
+			raise ValueError("t holds %d values for %d pairs, expected 1 or %d" % (len(ft), n, n))
+	
+	oa = 0
+	ob = 0
+	o = 0
+	for i in range(n):
+		ax, ay, az, aw = fa[oa:oa + 4]
+		bx, by, bz, bw = fb[ob:ob + 4]
+		
+		if (ft is not None):
+			slerp = ft[i * st]
+		
+		cosHalfTheta = ax * bx + ay * by + az * bz + aw * bw
+		
+		if (cosHalfTheta < 0.0):
+			cosHalfTheta = -cosHalfTheta
+			bx = -bx
+			by = -by
+			bz = -bz
+			bw = -bw
+		
+		if (cosHalfTheta >= 1.0):
+			ratioA = 1.0
+			ratioB = 0.0
+		
+		else:
+			halfTheta = acos(cosHalfTheta)
+			sinHalfTheta = sqrt(1.0 - cosHalfTheta * cosHalfTheta)
+			
+			if (fabs(sinHalfTheta) < 0.001):
+				ratioA = 0.5
+				ratioB = 0.5
+			
+			else:
+				ratioA = sin((1 - slerp) * halfTheta) / sinHalfTheta
+				ratioB = sin(slerp * halfTheta) / sinHalfTheta
+		
+		fo[o] = ax * ratioA + bx * ratioB
+		fo[o + 1] = ay * ratioA + by * ratioB
+		fo[o + 2] = az * ratioA + bz * ratioB
+		fo[o + 3] = aw * ratioA + bw * ratioB
+		
+		oa += sa
+		ob += sb
+		o += 4
+	
+	return out
+
+# Inverts N matrices with the same cofactor expansion as mat4_inverse. Returns a
+# mask with one boolean per matrix telling whether it was invertible; singular
+# matrices leave their slot in out untouched instead of stopping the batch.
+# The mask is a NumPy bool array on the NumPy path and a list otherwise.
+# If out is None, the matrices are inverted in place.
+#
+# Batches known to hold only affine or rigid matrices can pass MAT4_AFFINE or
+# MAT4_RIGID as kind to use the matching fast path.
+def mat4_inverse_batch(mats, out=None, kind=MAT4_GENERAL):
+
+	if (MAT4_AFFINE == kind):
+		return mat4_inverse_affine_batch(mats, out)
+	
+	if (MAT4_RIGID == kind):
+		mat4_inverse_rigid_batch(mats, out)
+		
+		if _batch_use_numpy(mats if out is None else out):
+			return np.ones(len(_batch_view(mats, 16)), dtype=bool)
+		
+		return [True] * _batch_count(_batch_flat(mats), 16)
+	
+	if (out is None):
+		out = mats
+	
+	_batch_kind(out)
+	
+	if _batch_use_numpy(out):
+		a = _batch_view(mats, 16)
+		o = _batch_out_view(out, 16)
+		
+		a00, a01, a02, a03, a10, a11, a12, a13, a20, a21, a22, a23, a30, a31, a32, a33 = a.T
+		b00 = a00 * a11 - a01 * a10
+		b01 = a00 * a12 - a02 * a10
+		b02 = a00 * a13 - a03 * a10
+		b03 = a01 * a12 - a02 * a11
+		b04 = a01 * a13 - a03 * a11
+		b05 = a02 * a13 - a03 * a12
+		b06 = a20 * a31 - a21 * a30
+		b07 = a20 * a32 - a22 * a30
+		b08 = a20 * a33 - a23 * a30
+		b09 = a21 * a32 - a22 * a31
+		b10 = a21 * a33 - a23 * a31
+		b11 = a22 * a33 - a23 * a32
+		d = (b00 * b11 - b01 * b10 + b02 * b09 + b03 * b08 - b04 * b07 + b05 * b06)
+		
+		mask = (d != 0)
+		invDet = 1 / np.where(mask, d, 1)
+		
+		r = np.empty((len(d), 16), dtype=np.result_type(a, np.float32))
+		r[:, 0] = (a11 * b11 - a12 * b10 + a13 * b09) * invDet
+		r[:, 1] = (-a01 * b11 + a02 * b10 - a03 * b09) * invDet
+		r[:, 2] = (a31 * b05 - a32 * b04 + a33 * b03) * invDet
+		r[:, 3] = (-a21 * b05 + a22 * b04 - a23 * b03) * invDet
+		r[:, 4] = (-a10 * b11 + a12 * b08 - a13 * b07) * invDet
+		r[:, 5] = (a00 * b11 - a02 * b08 + a03 * b07) * invDet
+		r[:, 6] = (-a30 * b05 + a32 * b02 - a33 * b01) * invDet
+		r[:, 7] = (a20 * b05 - a22 * b02 + a23 * b01) * invDet
+		r[:, 8] = (a10 * b10 - a11 * b08 + a13 * b06) * invDet
+		r[:, 9] = (-a00 * b10 + a01 * b08 - a03 * b06) * invDet
+		r[:, 10] = (a30 * b04 - a31 * b02 + a33 * b00) * invDet
+		r[:, 11] = (-a20 * b04 + a21 * b02 - a23 * b00) * invDet
+		r[:, 12] = (-a10 * b09 + a11 * b07 - a12 * b06) * invDet
+		r[:, 13] = (a00 * b09 - a01 * b07 + a02 * b06) * invDet
+		r[:, 14] = (-a30 * b03 + a31 * b01 - a32 * b00) * invDet
+		r[:, 15] = (a20 * b03 - a21 * b01 + a22 * b00) * invDet
+		
+		o[mask] = r[mask]
+		
+		return mask
+	
+	fa = _batch_flat(mats)
+	fo = _batch_flat(out)
+	n = _batch_count(fa, 16)
+	mask = [False] * n
+	
+	o = 0
+	for i in range(n):
+		a00, a01, a02, a03, a10, a11, a12, a13, a20, a21, a22, a23, a30, a31, a32, a33 = fa[o:o + 16]
+		b00 = a00 * a11 - a01 * a10
+		b01 = a00 * a12 - a02 * a10
+		b02 = a00 * a13 - a03 * a10
+		b03 = a01 * a12 - a02 * a11
+		b04 = a01 * a13 - a03 * a11
+		b05 = a02 * a13 - a03 * a12
+		b06 = a20 * a31 - a21 * a30
+		b07 = a20 * a32 - a22 * a30
+		b08 = a20 * a33 - a23 * a30
+		b09 = a21 * a32 - a22 * a31
+		b10 = a21 * a33 - a23 * a31
+		b11 = a22 * a33 - a23 * a32
+		d = (b00 * b11 - b01 * b10 + b02 * b09 + b03 * b08 - b04 * b07 + b05 * b06)
+		
+		if (0 != d):
+			invDet = 1 / d
+			
+			fo[o] = (a11 * b11 - a12 * b10 + a13 * b09) * invDet
+			fo[o + 1] = (-a01 * b11 + a02 * b10 - a03 * b09) * invDet
+			fo[o + 2] = (a31 * b05 - a32 * b04 + a33 * b03) * invDet
+			fo[o + 3] = (-a21 * b05 + a22 * b04 - a23 * b03) * invDet
+			fo[o + 4] = (-a10 * b11 + a12 * b08 - a13 * b07) * invDet
+			fo[o + 5] = (a00 * b11 - a02 * b08 + a03 * b07) * invDet
+			fo[o + 6] = (-a30 * b05 + a32 * b02 - a33 * b01) * invDet
+			fo[o + 7] = (a20 * b05 - a22 * b02 + a23 * b01) * invDet
+			fo[o + 8] = (a10 * b10 - a11 * b08 + a13 * b06) * invDet
+			fo[o + 9] = (-a00 * b10 + a01 * b08 - a03 * b06) * invDet
+			fo[o + 10] = (a30 * b04 - a31 * b02 + a33 * b00) * invDet
+			fo[o + 11] = (-a20 * b04 + a21 * b02 - a23 * b00) * invDet
+			fo[o + 12] = (-a10 * b09 + a11 * b07 - a12 * b06) * invDet
+			fo[o + 13] = (a00 * b09 - a01 * b07 + a02 * b06) * invDet
+			fo[o + 14] = (-a30 * b03 + a31 * b01 - a32 * b00) * invDet
+			fo[o + 15] = (a20 * b03 - a21 * b01 + a22 * b00) * invDet
+			
+			mask[i] = True
+		
+		o += 16
+	
+	return mask
+
+# Batched mat4_inverse_affine. Returns an invertibility mask as mat4_inverse_batch
+# does, singular matrices leave their slot in out untouched.
+def mat4_inverse_affine_batch(mats, out=None):
+
+	if (out is None):
+		out = mats
+	
+	_batch_kind(out, MAT4_AFFINE)
+	
+	if _batch_use_numpy(out):
+		a = _batch_view(mats, 16)
+		o = _batch_out_view(out, 16)
+		
+		a00, a01, a02, a03, a10, a11, a12, a13, a20, a21, a22, a23, tx, ty, tz, a33 = a.T
+		b01 = a22 * a11 - a12 * a21
+		b11 = -a22 * a10 + a12 * a20
+		b21 = a21 * a10 - a11 * a20
+		d = a00 * b01 + a01 * b11 + a02 * b21
+		
+		mask = (d != 0)
+		id = 1 / np.where(mask, d, 1)
+		
+		r = np.zeros((len(d), 16), dtype=np.result_type(a, np.float32))
+		r[:, 0] = r0 = b01 * id
+		r[:, 1] = r1 = (-a22 * a01 + a02 * a21) * id
+		r[:, 2] = r2 = (a12 * a01 - a02 * a11) * id
+		r[:, 4] = r3 = b11 * id
+		r[:, 5] = r4 = (a22 * a00 - a02 * a20) * id
+		r[:, 6] = r5 = (-a12 * a00 + a02 * a10) * id
+		r[:, 8] = r6 = b21 * id
+		r[:, 9] = r7 = (-a21 * a00 + a01 * a20) * id
+		r[:, 10] = r8 = (a11 * a00 - a01 * a10) * id
+		r[:, 12] = -(r0 * tx + r3 * ty + r6 * tz)
+		r[:, 13] = -(r1 * tx + r4 * ty + r7 * tz)
+		r[:, 14] = -(r2 * tx + r5 * ty + r8 * tz)
+		r[:, 15] = 1
+		
+		o[mask] = r[mask]
+		
+		return mask
+	
+	fa = _batch_flat(mats)
+	fo = _batch_flat(out)
+	n = _batch_count(fa, 16)
+	mask = [False] * n
+	m = [0.0] * 16
+	
+	o = 0
+	for i in range(n):
+		for k in range(16):
+			m[k] = fa[o + k]
+		
+		if (mat4_inverse_affine(m, None) is not None):
+			for k in range(16):
+				fo[o + k] = m[k]
+			
+			mask[i] = True
+		
+		o += 16
+	
+	return mask
+
+# Batched mat4_inverse_rigid. Rigid matrices are always invertible, so out is
+# returned rather than a mask.
+def mat4_inverse_rigid_batch(mats, out=None):
+
+	if (out is None):
+		out = mats
+	
+	_batch_kind(out, MAT4_RIGID)
+	
+	if _batch_use_numpy(out):
+		a = _batch_view(mats, 16)
+		o = _batch_out_view(out, 16)
+		
+		# Transposing the 3x3 part of the (N, 4, 4) view transposes the rotation
+		v = a.reshape(-1, 4, 4)
+		r = np.zeros_like(v, dtype=np.result_type(a, np.float32))
+		r[:, :3, :3] = v[:, :3, :3].transpose(0, 2, 1)
+		r[:, 3, :3] = -np.einsum('nij,nj->ni', v[:, :3, :3], v[:, 3, :3])
+		r[:, 3, 3] = 1
+		
+		o[...] = r.reshape(-1, 16)
+		
+		return out
+	
+	fa = _batch_flat(mats)
+	fo = _batch_flat(out)
+	n = _batch_count(fa, 16)
+	
+	o = 0
+	for i in range(n):
+		a00, a01, a02, a03, a10, a11, a12, a13, a20, a21, a22, a23, tx, ty, tz, a33 = fa[o:o + 16]
+		
+		fo[o] = a00
+		fo[o + 1] = a10
+		fo[o + 2] = a20
+		fo[o + 3] = 0
+		fo[o + 4] = a01
+		fo[o + 5] = a11
+		fo[o + 6] = a21
+		fo[o + 7] = 0
+		fo[o + 8] = a02
+		fo[o + 9] = a12
+		fo[o + 10] = a22
+		fo[o + 11] = 0
+		fo[o + 12] = -(a00 * tx + a01 * ty + a02 * tz)
+		fo[o + 13] = -(a10 * tx + a11 * ty + a12 * tz)
+		fo[o + 14] = -(a20 * tx + a21 * ty + a22 * tz)
+		fo[o + 15] = 1
+		
+		o += 16
+	
+	return out
+
+# Quaternion of a pure rotation given by the upper 3x3 elements of a mat4, with
+# the same branches as quat_from_mat4. Returns x, y, z, w.
+def _quat_from_rotation(m0, m1, m2, m4, m5, m6, m8, m9, m10):
+	diagonal = m0 + m5 + m10 + 1
+	
+	if (diagonal > sys.float_info.epsilon):
+		scale = sqrt(diagonal) * 2.0
+		return ((m6 - m9) / scale, (m8 - m2) / scale, (m1 - m4) / scale, 0.25 * scale)
+	
+	if (m0 > m5 and m0 > m10):
+		scale = sqrt(1.0 + m0 - m5 - m10) * 2.0
+		return (0.25 * scale, (m1 + m4) / scale, (m8 + m2) / scale, (m6 - m9) / scale)
+	
+	if (m5 > m10):
+		scale = sqrt(1.0 + m5 - m0 - m10) * 2.0
+		return ((m1 + m4) / scale, 0.25 * scale, (m6 + m9) / scale, (m8 - m2) / scale)
+	
+	scale = sqrt(1.0 + m10 - m0 - m5) * 2.0
+	return ((m8 + m2) / scale, (m6 + m9) / scale, 0.25 * scale, (m1 - m4) / scale)
+
+# Vectorized _quat_from_rotation over NumPy arrays of elements. The four branches
+# of quat_from_mat4 become masks, and each element takes the values of its branch.
+def _np_quat_from_rotation(m0, m1, m2, m4, m5, m6, m8, m9, m10):
+	diagonal = m0 + m5 + m10 + 1
+	
+	c0 = diagonal > sys.float_info.epsilon
+	c1 = ~c0 & (m0 > m5) & (m0 > m10)
+	c2 = ~c0 & ~c1 & (m5 > m10)
+	c3 = ~(c0 | c1 | c2)
+	branches = [c0, c1, c2, c3]
+	
+	with np.errstate(divide='ignore', invalid='ignore'):
+		scale = np.sqrt(np.select(branches, [diagonal, 1.0 + m0 - m5 - m10, 1.0 + m5 - m0 - m10, 1.0 + m10 - m0 - m5])) * 2.0
+		quarter = 0.25 * scale
+		a = (m6 - m9) / scale
+		b = (m8 - m2) / scale
+		c = (m1 - m4) / scale
+		d = (m1 + m4) / scale
+		e = (m8 + m2) / scale
+		f = (m6 + m9) / scale
+	
+	x = np.select(branches, [a, quarter, d, e])
+	y = np.select(branches, [b, d, quarter, f])
+	z = np.select(branches, [c, e, f, quarter])
+	w = np.select(branches, [quarter, a, b, c])
+	
+	return x, y, z, w
+
+# Converts N rotation matrices to quaternions with the OpenGL order algorithm of
+# quat_from_mat4, branches handled with masks. mats holds N mat4 (16 floats each)
+# or N mat3 (9 floats each); width is taken from a two-dimensional buffer's shape
+# and otherwise defaults to 16. With normalize set the quaternions are rescaled
+# to unit length, and with canonical set they are negated where needed so that
+# w >= 0. If out is None a new buffer is allocated, as for mat4_decompose_batch.
+def quat_from_mat4_batch(mats, out=None, normalize=False, canonical=False, width=None):
+
+	if width is None:
+		shape = getattr(mats, 'shape', None)
+		width = shape[-1] if shape and len(shape) == 2 else 16
+	
+	if 16 == width:
+		i0, i1, i2, i4, i5, i6, i8, i9, i10 = 0, 1, 2, 4, 5, 6, 8, 9, 10
+	
+	elif 9 == width:
+		i0, i1, i2, i4, i5, i6, i8, i9, i10 = 0, 1, 2, 3, 4, 5, 6, 7, 8
+	
+	else:
+		raise ValueError("rotation matrices must have 9 or 16 elements, not %d" % width)
+	
+	_batch_kind(out)
+	
+	if (np is not None) and not isinstance(out, list):
+		a = _batch_view(mats, width)
+		
+		if out is None:
+			out = np.empty((len(a), 4))
+		
+		o = _batch_out_view(out, 4)
+		
+		x, y, z, w = _np_quat_from_rotation(a[:, i0], a[:, i1], a[:, i2], a[:, i4], a[:, i5], a[:, i6], a[:, i8], a[:, i9], a[:, i10])
+		q = np.stack((x, y, z, w), axis=1)
+		
+		if normalize:
+			q /= np.sqrt((q * q).sum(axis=1))[:, None]
+		
+		if canonical:
+			q[w < 0] *= -1
+		
+		o[...] = q
+		
+		return out
+	
+	fa = _batch_flat(mats)
+	n = _batch_count(fa, width)
+	
+	if out is None:
+		out = array('d', bytes(n * 4 * 8))
+	
+	fo = _batch_flat(out)
+	
+	for i in range(n):
+		o = i * width
+		x, y, z, w = _quat_from_rotation(fa[o + i0], fa[o + i1], fa[o + i2], fa[o + i4], fa[o + i5], fa[o + i6], fa[o + i8], fa[o + i9], fa[o + i10])
+		
+		if normalize:
+			invLen = 1 / sqrt(x * x + y * y + z * z + w * w)
+			x = x * invLen
+			y = y * invLen
+			z = z * invLen
+			w = w * invLen
+		
+		if canonical and w < 0:
+			x = -x
+			y = -y
+			z = -z
+			w = -w
+		
+		o = i * 4
+		fo[o] = x
+		fo[o + 1] = y
+		fo[o + 2] = z
+		fo[o + 3] = w
+	
+	return out
+
+# Decomposes N matrices into translations, rotation quaternions and scales in one
+# pass, as mat4_decompose does for one. Outputs not given are allocated, as NumPy
+# arrays of shape (N, 3), (N, 4) and (N, 3) when NumPy is available and as flat
+# array('d') otherwise. A matrix with a zero scale gets a NaN rotation, and the
+# rest of the batch is unaffected. Returns (translations, rotations, scales).
+def mat4_decompose_batch(mats, translations=None, rotations=None, scales=None):
+
+	_batch_kind(translations)
+	_batch_kind(rotations)
+	_batch_kind(scales)
+	
+	if (np is not None) and not isinstance(translations, list) and not isinstance(rotations, list) and not isinstance(scales, list):
+		a = _batch_view(mats, 16)
+		n = len(a)
+		
+		if translations is None:
+			translations = np.empty((n, 3))
+		
+		if rotations is None:
+			rotations = np.empty((n, 4))
+		
+		if scales is None:
+			scales = np.empty((n, 3))
+		
+		t = _batch_out_view(translations, 3)
+		r = _batch_out_view(rotations, 4)
+		s = _batch_out_view(scales, 3)
+		
+		sx = np.sqrt((a[:, 0:3] * a[:, 0:3]).sum(axis=1))
+		sy = np.sqrt((a[:, 4:7] * a[:, 4:7]).sum(axis=1))
+		sz = np.sqrt((a[:, 8:11] * a[:, 8:11]).sum(axis=1))
+		
+		with np.errstate(divide='ignore', invalid='ignore'):
+			x, y, z, w = _np_quat_from_rotation(
+				a[:, 0] / sx, a[:, 1] / sx, a[:, 2] / sx,
+				a[:, 4] / sy, a[:, 5] / sy, a[:, 6] / sy,
+				a[:, 8] / sz, a[:, 9] / sz, a[:, 10] / sz)
+		
+		t[...] = a[:, 12:15]
+		r[:, 0] = x
+		r[:, 1] = y
+		r[:, 2] = z
+		r[:, 3] = w
+		s[:, 0] = sx
+		s[:, 1] = sy
+		s[:, 2] = sz
+		
+		return translations, rotations, scales
+	
+	fa = _batch_flat(mats)
+	n = _batch_count(fa, 16)
+	
+	if translations is None:
+		translations = array('d', bytes(n * 3 * 8))
+	
+	if rotations is None:
+		rotations = array('d', bytes(n * 4 * 8))
+	
+	if scales is None:
+		scales = array('d', bytes(n * 3 * 8))
+	
+	ft = _batch_flat(translations)
+	fr = _batch_flat(rotations)
+	fs = _batch_flat(scales)
+	
+	for i in range(n):
+		m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11, m12, m13, m14, m15 = fa[i * 16:i * 16 + 16]
+		
+		sx = sqrt(m0 * m0 + m1 * m1 + m2 * m2)
+		sy = sqrt(m4 * m4 + m5 * m5 + m6 * m6)
+		sz = sqrt(m8 * m8 + m9 * m9 + m10 * m10)
+		
+		# A zero scale leaves no rotation to recover; NaN, as on the NumPy path
+		if (0 == sx) or (0 == sy) or (0 == sz):
+			x = y = z = w = float('nan')
+		
+		else:
+			x, y, z, w = _quat_from_rotation(m0 / sx, m1 / sx, m2 / sx, m4 / sy, m5 / sy, m6 / sy, m8 / sz, m9 / sz, m10 / sz)
+		
+		o = i * 3
+		ft[o] = m12
+		ft[o + 1] = m13
+		ft[o + 2] = m14
+		fs[o] = sx
+		fs[o + 1] = sy
+		fs[o + 2] = sz
+		
+		o = i * 4
+		fr[o] = x
+		fr[o + 1] = y
+		fr[o + 2] = z
+		fr[o + 3] = w
+	
+	return translations, rotations, scales
+
+# Batched mat4_fromRotationTranslationScale : builds N model matrices from
+# packed (N, 4) quaternions, (N, 3) translations and (N, 3) scales, writing each
+# one directly into out, allocated when None. An input holding a single item is
+# shared by every matrix.
+def mat4_fromRotationTranslationScale_batch(rotations, translations, scales, out=None):
+
+	_batch_kind(out, MAT4_AFFINE)
+	
+	if _batch_use_numpy(out):
+		t = _batch_view(translations, 3)
+		x, y, z, w = _batch_view(rotations, 4).T
+		sx, sy, sz = _batch_view(scales, 3).T
+		
+		if (out is None):
+			out = np.empty((max(len(t), len(x), len(sx)), 16))
+		
+		o = _batch_out_view(out, 16)
+		
+		x2 = x + x
+		y2 = y + y
+		z2 = z + z
+		xx = x * x2
+		xy = x * y2
+		xz = x * z2
+		yy = y * y2
+		yz = y * z2
+		zz = z * z2
+		wx = w * x2
+		wy = w * y2
+		wz = w * z2
+		
+		o[:, 0] = (1 - (yy + zz)) * sx
+		o[:, 1] = (xy + wz) * sx
+		o[:, 2] = (xz - wy) * sx
+		o[:, 3] = 0
+		o[:, 4] = (xy - wz) * sy
+		o[:, 5] = (1 - (xx + zz)) * sy
+		o[:, 6] = (yz + wx) * sy
+		o[:, 7] = 0
+		o[:, 8] = (xz + wy) * sz
+		o[:, 9] = (yz - wx) * sz
+		o[:, 10] = (1 - (xx + yy)) * sz
+		o[:, 11] = 0
+		o[:, 12:15] = t
+		o[:, 15] = 1
+		
+		return out
+	
+	fr = _batch_flat(rotations)
+	ft = _batch_flat(translations)
+	fs = _batch_flat(scales)
+	nr = _batch_count(fr, 4)
+	nt = _batch_count(ft, 3)
+	ns = _batch_count(fs, 3)
+	n = _batch_broadcast(nr, nt, ns)
+	sr = 4 if nr > 1 else 0
+	st = 3 if nt > 1 else 0
+	ss = 3 if ns > 1 else 0
+	
+	if (out is None):
+		out = array('d', bytes(n * 16 * 8))
+	
+	fo = _batch_flat(out)
+	
+	for i in range(n):
+		x, y, z, w = fr[i * sr:i * sr + 4]
+		tx, ty, tz = ft[i * st:i * st + 3]
+		sx, sy, sz = fs[i * ss:i * ss + 3]
+		
+		x2 = x + x
+		y2 = y + y
+		z2 = z + z
+		xx = x * x2
+		xy = x * y2
+		xz = x * z2
+		yy = y * y2
+		yz = y * z2
+		zz = z * z2
+		wx = w * x2
+		wy = w * y2
+		wz = w * z2
+		
+		o = i * 16
+		fo[o] = (1 - (yy + zz)) * sx
+		fo[o + 1] = (xy + wz) * sx
+		fo[o + 2] = (xz - wy) * sx
+		fo[o + 3] = 0.0
+		fo[o + 4] = (xy - wz) * sy
+		fo[o + 5] = (1 - (xx + zz)) * sy
+		fo[o + 6] = (yz + wx) * sy
+		fo[o + 7] = 0.0
+		fo[o + 8] = (xz + wy) * sz
+		fo[o + 9] = (yz - wx) * sz
+		fo[o + 10] = (1 - (xx + yy)) * sz
+		fo[o + 11] = 0.0
+		fo[o + 12] = tx
+		fo[o + 13] = ty
+		fo[o + 14] = tz
+		fo[o + 15] = 1.0
+	
+	return out
+
+################################################################################
+
+# Frustum culling
+#
+# Planes are stored as 6 packed (a, b, c, d) vectors, 24 floats, in the order
+# left, right, bottom, top, near, far. Normals point inwards and are of unit
+# length, so a*x + b*y + c*z + d is the signed distance of a point to a plane,
+# positive inside.
+
+# Extracts the frustum planes of a view-projection (or projection) matrix, as
+# built by mat4_frustum, mat4_perspective or mat4_ortho multiplied with a view.
+def frustum_planes_from_mat4(viewProj, dest=None):
+
+	if (dest is None):
+		dest = [0.0] * 24
+	
+	m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11, m12, m13, m14, m15 = viewProj[0:16]
+	
+	# Rows of the matrix combined with the last row, after Gribb & Hartmann
+	planes = (
+		(m3 + m0, m7 + m4, m11 + m8, m15 + m12),
+		(m3 - m0, m7 - m4, m11 - m8, m15 - m12),
+		(m3 + m1, m7 + m5, m11 + m9, m15 + m13),
+		(m3 - m1, m7 - m5, m11 - m9, m15 - m13),
+		(m3 + m2, m7 + m6, m11 + m10, m15 + m14),
+		(m3 - m2, m7 - m6, m11 - m10, m15 - m14),
+	)
+	
+	o = 0
+	for a, b, c, d in planes:
+		len = sqrt(a * a + b * b + c * c)
+		
+		if (0 != len):
+			len = 1 / len
+		
+		dest[o] = a * len
+		dest[o + 1] = b * len
+		dest[o + 2] = c * len
+		dest[o + 3] = d * len
+		
+		o += 4
+	
+	return dest
+
+# Visibility of N spheres against the frustum planes. radii is a single radius
+# or one per sphere. Returns a mask, True for spheres at least partly inside,
+# as a NumPy bool array or a list; out may be given to receive it.
+def cull_spheres(planes, centers, radii, out=None):
+
+	if _batch_use_numpy(out):
+		p = np.asarray(planes, dtype=np.float64).reshape(6, 4)
+		c = _batch_view(centers, 3)
+		r = np.asarray(radii, dtype=np.float64).reshape(-1, 1)
+		
+		visible = ((c @ p[:, :3].T + p[:, 3]) >= -r).all(axis=1)
+		
+		if out is None:
+			return visible
+		
+		np.asarray(out)[...] = visible
+		
+		return out
+	
+	fc = _batch_flat(centers)
+	n = _batch_count(fc, 3)
+	
+	# Any real scalar, NumPy scalars included, is one radius for every sphere
+	if isinstance(radii, numbers.Real):
+		fr = None
+		radius = radii
+	
+	else:
+		fr = _batch_flat(radii)
+	
+	if out is None:
+		out = [False] * n
+	
+	for i in range(n):
+		x, y, z = fc[i * 3:i * 3 + 3]
+		
+		if (fr is not None):
+			radius = fr[i]
+		
+		visible = True
+		for o in range(0, 24, 4):
+			if planes[o] * x + planes[o + 1] * y + planes[o + 2] * z + planes[o + 3] < -radius:
+				visible = False
+				break
+		
+		out[i] = visible
+	
+	return out
+
+# Visibility of N axis aligned boxes, given by their min and max corners, against
+# the frustum planes. A box is culled when it lies fully outside one plane, so
+# boxes near frustum corners may be kept, as is usual. Returns a mask as
+# cull_spheres does.
+def cull_aabbs(planes, mins, maxs, out=None):
+
+	if _batch_use_numpy(out):
+		p = np.asarray(planes, dtype=np.float64).reshape(6, 4)
+		lo = _batch_view(mins, 3)
+		hi = _batch_view(maxs, 3)
+		
+		# Distance of the corner furthest along each normal, from centre and extents
+		centre = (lo + hi) * 0.5
+		extent = (hi - lo) * 0.5
+		visible = ((centre @ p[:, :3].T + extent @ np.fabs(p[:, :3]).T + p[:, 3]) >= 0).all(axis=1)
+		
+		if out is None:
+			return visible
+		
+		np.asarray(out)[...] = visible
+		
+		return out
+	
+	flo = _batch_flat(mins)
+	fhi = _batch_flat(maxs)
+	n = _batch_count(flo, 3)
+	
+	if out is None:
+		out = [False] * n
+	
+	for i in range(n):
+		x0, y0, z0 = flo[i * 3:i * 3 + 3]
+		x1, y1, z1 = fhi[i * 3:i * 3 + 3]
+		
+		visible = True
+		for o in range(0, 24, 4):
+			a = planes[o]
+			b = planes[o + 1]
+			c = planes[o + 2]
+			
+			# Corner furthest along the plane normal
+			x = x1 if a >= 0 else x0
+			y = y1 if b >= 0 else y0
+			z = z1 if c >= 0 else z0
+			
+			if a * x + b * y + c * z + planes[o + 3] < 0:
+				visible = False
+				break
+		
+		out[i] = visible
+	
+	return out
+
+################################################################################
+
+# Projection and unprojection
+#
+# vec3_unproject multiplies proj * view and inverts it on every call. An
+# Unprojector does that once and then maps any number of window coordinates
+# (x, y in pixels, z depth in 0..1) back to world space in a single pass.
+
+class Unprojector:
+	def __init__(self, view, proj, viewport):
+		self.viewport = [viewport[0], viewport[1], viewport[2], viewport[3]]
+		self.inverse = mat4_create(None)
+		
+		if (_matrixcache is None):
+			mat4_multiply(proj, view, self.inverse)
+			self.valid = mat4_inverse(self.inverse, None) is not None
+		
+		else:
+			self.valid = _matrixcache.viewProjInverse(view, proj, self.inverse) is not None
+	
+	# Uses an already known inverse of proj * view, such as the one returned by
+	# MatrixCache.viewProjInverse. The inverses of proj and of view on their own
+	# do not fit here.
+	def setInverse(self, inverse):
+		mat4_set(inverse, self.inverse)
+		self.valid = True
+	
+	# Unprojects N packed window coordinates into dest. If dest is None, the
+	# coordinates are unprojected in place. Points mapping to w = 0 come out as
+	# inf or nan, and every point comes out as nan if proj * view is singular.
+	def unproject(self, wins, dest=None):
+		if (dest is None):
+			dest = wins
+		
+		_batch_kind(dest)
+		
+		vx, vy, vw, vh = self.viewport
+		
+		if _batch_use_numpy(dest):
+			w = _batch_view(wins, 3)
+			o = _batch_out_view(dest, 3)
+			
+			if not self.valid:
+				o[...] = np.nan
+				return dest
+			
+			ndc = np.empty((len(w), 4))
+			ndc[:, 0] = (w[:, 0] - vx) * 2.0 / vw - 1.0
+			ndc[:, 1] = (w[:, 1] - vy) * 2.0 / vh - 1.0
+			ndc[:, 2] = 2.0 * w[:, 2] - 1.0
+			ndc[:, 3] = 1.0
+			
+			# Row-major view of the column-major inverse is its transpose
+			p = ndc @ np.reshape(np.asarray(self.inverse, dtype=np.float64), (4, 4))
+			
+			with np.errstate(divide='ignore', invalid='ignore'):
+				o[...] = p[:, :3] / p[:, 3:]
+			
+			return dest
+		
+		fw = _batch_flat(wins)
+		fo = _batch_flat(dest)
+		n = _batch_count(fw, 3)
+		
+		if not self.valid:
+			for i in range(n * 3):
+				fo[i] = float('nan')
+			
+			return dest
+		
+		m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11, m12, m13, m14, m15 = self.inverse[0:16]
+		sx = 2.0 / vw
+		sy = 2.0 / vh
+		
+		for i in range(n):
+			o = i * 3
+			x = (fw[o] - vx) * sx - 1.0
+			y = (fw[o + 1] - vy) * sy - 1.0
+			z = 2.0 * fw[o + 2] - 1.0
+			
+			w = m3 * x + m7 * y + m11 * z + m15
+			
+			if (0 == w):
+				fo[o] = fo[o + 1] = fo[o + 2] = float('nan')
+				continue
+			
+			w = 1 / w
+			fo[o] = (m0 * x + m4 * y + m8 * z + m12) * w
+			fo[o + 1] = (m1 * x + m5 * y + m9 * z + m13) * w
+			fo[o + 2] = (m2 * x + m6 * y + m10 * z + m14) * w
+		
+		return dest
+	
+	# Rays through N packed window positions (x, y), or through the centre of
+	# every viewport pixel, row by row, when points is None. Origins lie on the
+	# near plane and directions are normalized. Both are written into the given
+	# (N,3) buffers, allocated only when None, and come out as nan if proj * view
+	# is singular. Returns (origins, directions).
+	def rays(self, points=None, origins=None, directions=None):
+		vx, vy, vw, vh = self.viewport
+		_batch_kind(origins)
+		_batch_kind(directions)
+		
+		
+		if _batch_use_numpy(origins) and _batch_use_numpy(directions):
+			if points is None:
+				gy, gx = np.mgrid[0:int(vh), 0:int(vw)]
+				xy = np.stack((gx.ravel() + vx + 0.5, gy.ravel() + vy + 0.5), axis=1)
+			
+			else:
+				xy = _batch_view(points, 2)
+			
+			if (origins is None):
+				origins = np.empty((len(xy), 3))
+			
+			if (directions is None):
+				directions = np.empty((len(xy), 3))
+			
+			o = _batch_out_view(origins, 3)
+			d = _batch_out_view(directions, 3)
+			
+			# Near and far window positions, unprojected in place
+			o[:, 0:2] = xy
+			o[:, 2] = 0.0
+			d[:, 0:2] = xy
+			d[:, 2] = 1.0
+			self.unproject(o)
+			self.unproject(d)
+			
+			with np.errstate(divide='ignore', invalid='ignore'):
+				d -= o
+				d /= np.sqrt((d * d).sum(axis=1))[:, None]
+			
+			return origins, directions
+		
+		if points is None:
+			points = array('d')
+			for y in range(int(vh)):
+				for x in range(int(vw)):
+					points.append(vx + x + 0.5)
+					points.append(vy + y + 0.5)
+		
+		fp = _batch_flat(points)
+		n = _batch_count(fp, 2)
+		
+		if (origins is None):
+			origins = array('d', bytes(n * 3 * 8))
+		
+		if (directions is None):
+			directions = array('d', bytes(n * 3 * 8))
+		
+		fo = _batch_flat(origins)
+		fd = _batch_flat(directions)
+		
+		for i in range(n):
+			o = i * 3
+			fo[o] = fd[o] = fp[i * 2]
+			fo[o + 1] = fd[o + 1] = fp[i * 2 + 1]
+			fo[o + 2] = 0.0
+			fd[o + 2] = 1.0
+		
+		self.unproject(fo)
+		self.unproject(fd)
+		
+		for i in range(n):
+			o = i * 3
+			x = fd[o] - fo[o]
+			y = fd[o + 1] - fo[o + 1]
+			z = fd[o + 2] - fo[o + 2]
+			d = sqrt(x * x + y * y + z * z)
+			
+			if (0 < d):
+				d = 1 / d
+			
+			fd[o] = x * d
+			fd[o + 1] = y * d
+			fd[o + 2] = z * d
+		
+		return origins, directions
+
+# Batched vec3_unproject : computes the inverse of proj * view once and unprojects
+# N packed window coordinates into dest. If dest is None, the coordinates are
+# unprojected in place.
+def vec3_unproject_batch(vecs, view, proj, viewport, dest=None):
+
+	return Unprojector(view, proj, viewport).unproject(vecs, dest)
+
+# Batched vec3_project : maps N packed world points to window coordinates
+# (x, y in pixels, z depth in 0..1). Returns a mask that is False for points on
+# or behind the camera plane (clip w <= 0), whose slot in out is left untouched.
+# The mask is a NumPy bool array on the NumPy path and a list otherwise.
+# If out is None, the points are projected in place.
+def vec3_project_batch(points, view, proj, viewport, out=None):
+
+	if (out is None):
+		out = points
+	
+	_batch_kind(out)
+	
+	m = mat4_multiply(proj, view, mat4_create(None))
+	vx, vy, vw, vh = viewport[0:4]
+	
+	if _batch_use_numpy(out):
+		a = _batch_view(points, 3)
+		o = _batch_out_view(out, 3)
+		
+		mm = np.reshape(np.asarray(m, dtype=np.float64), (4, 4))
+		p = a @ mm[0:3] + mm[3]
+		
+		mask = p[:, 3] > 0
+		p = p[mask]
+		w = 1 / p[:, 3]
+		
+		r = np.empty((len(p), 3))
+		r[:, 0] = vx + (p[:, 0] * w + 1.0) * (vw * 0.5)
+		r[:, 1] = vy + (p[:, 1] * w + 1.0) * (vh * 0.5)
+		r[:, 2] = (p[:, 2] * w + 1.0) * 0.5
+		o[mask] = r
+		
+		return mask
+	
+	fa = _batch_flat(points)
+	fo = _batch_flat(out)
+	n = _batch_count(fa, 3)
+	
+	m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11, m12, m13, m14, m15 = m[0:16]
+	sx = vw * 0.5
+	sy = vh * 0.5
+	mask = [False] * n
+	
+	for i in range(n):
+		o = i * 3
+		x = fa[o]
+		y = fa[o + 1]
+		z = fa[o + 2]
+		
+		w = m3 * x + m7 * y + m11 * z + m15
+		
+		if (w <= 0):
+			continue
+		
+		w = 1 / w
+		fo[o] = vx + ((m0 * x + m4 * y + m8 * z + m12) * w + 1.0) * sx
+		fo[o + 1] = vy + ((m1 * x + m5 * y + m9 * z + m13) * w + 1.0) * sy
+		fo[o + 2] = ((m2 * x + m6 * y + m10 * z + m14) * w + 1.0) * 0.5
+		mask[i] = True
+	
+	return mask
+
+################################################################################
+
+# Composition
+#
+# compose() returns a deferred builder for the usual translate / rotate / scale
+# / parent chain. The steps are only recorded, and matrix() evaluates them in
+# one pass over plain floats, without intermediate matrices or per-step calls.
+# Each step right-multiplies the result, as mat4_translate, mat4_rotate and
+# mat4_scale do; then(parent) left-multiplies it by parent. Steps keep
+# references to their values, so a composer built once can be evaluated again
+# after the values change.
+#
+# Steps may also be given N packed values, (N,3) translations and scales,
+# (N,4) quaternions or (N,16) matrices; matrices() then builds all N results,
+# in one vectorized pass with NumPy.
+
+_compose_widths = { 't' : 3, 's' : 3, 'r' : 4, 'm' : 16, 'p' : 16 }
+
+class Composer:
+	def __init__(self):
+		self.ops = []
+	
+	def translate(self, vec):
+		self.ops.append(('t', vec))
+		return self
+	
+	def scale(self, vec):
+		self.ops.append(('s', vec))
+		return self
+	
+	def rotateQuat(self, quat):
+		self.ops.append(('r', quat))
+		return self
+	
+	# Rotation of angle radians around axis, recorded as a quaternion
+	def rotate(self, angle, axis):
+		x = axis[0]
+		y = axis[1]
+		z = axis[2]
+		s = sin(angle * 0.5) / sqrt(x * x + y * y + z * z)
+		
+		return self.rotateQuat((x * s, y * s, z * s, cos(angle * 0.5)))
+	
+	def multiply(self, mat):
+		self.ops.append(('m', mat))
+		return self
+	
+	def then(self, parent):
+		self.ops.append(('p', parent))
+		return self
+	
+	def matrix(self, dest=None):
+		if (dest is None):
+			dest = mat4_create(None)
+		
+		elif (type(dest) is Mat4):
+			dest.kind = _compose_kind(self.ops)
+		
+		return _compose_eval(self.ops, dest)
+	
+	# Evaluates N results into out, allocated when None. Steps holding a single
+	# value apply to every result.
+	def matrices(self, out=None):
+		_batch_kind(out, _compose_kind(self.ops))
+		
+		if (np is not None) and not isinstance(out, list):
+			return _compose_eval_numpy(self.ops, out)
+		
+		counts = []
+		flats = []
+		
+		for kind, value in self.ops:
+			width = _compose_widths[kind]
+			flat = _batch_flat(value)
+			count = _batch_count(flat, width)
+			
+			flats.append((kind, flat, width, count > 1))
+			counts.append(count)
+		
+		n = _batch_broadcast(*counts) if counts else 1
+		
+		if (out is None):
+			out = array('d', bytes(n * 16 * 8))
+		
+		# Slices of a memoryview write through, slices of a list are copies
+		fo = out if isinstance(out, list) else _batch_flat(memoryview(out))
+		
+		for i in range(n):
+			ops = [(kind, flat[i * width:i * width + width] if batched else flat) for kind, flat, width, batched in flats]
+			
+			if isinstance(fo, list):
+				fo[i * 16:i * 16 + 16] = _compose_eval(ops, [0.0] * 16)
+			
+			else:
+				_compose_eval(ops, fo[i * 16:i * 16 + 16])
+		
+		return out
+
+def compose():
+	return Composer()
+
+# Translate, rotate and scale steps give an affine matrix; multiplied matrices
+# bring it down to the weakest of their kinds, plain lists being general.
+def _compose_kind(ops):
+	kind = MAT4_AFFINE
+	
+	for step, value in ops:
+		if ('m' == step) or ('p' == step):
+			kind = min(kind, _mat4_kind(value))
+	
+	return kind
+
+def _compose_eval(ops, dest):
+	m0 = 1.0; m1 = 0.0; m2 = 0.0; m3 = 0.0
+	m4 = 0.0; m5 = 1.0; m6 = 0.0; m7 = 0.0
+	m8 = 0.0; m9 = 0.0; m10 = 1.0; m11 = 0.0
+	m12 = 0.0; m13 = 0.0; m14 = 0.0; m15 = 1.0
+	
+	for kind, v in ops:
+		if ('t' == kind):
+			x = v[0]
+			y = v[1]
+			z = v[2]
+			m12 = m0 * x + m4 * y + m8 * z + m12
+			m13 = m1 * x + m5 * y + m9 * z + m13
+			m14 = m2 * x + m6 * y + m10 * z + m14
+			m15 = m3 * x + m7 * y + m11 * z + m15
+		
+		elif ('r' == kind):
+			x = v[0]
+			y = v[1]
+			z = v[2]
+			w = v[3]
+			x2 = x + x
+			y2 = y + y
+			z2 = z + z
+			xx = x * x2
+			xy = x * y2
+			xz = x * z2
+			yy = y * y2
+			yz = y * z2
+			zz = z * z2
+			wx = w * x2
+			wy = w * y2
+			wz = w * z2
+			
+			b00 = 1 - (yy + zz)
+			b01 = xy + wz
+			b02 = xz - wy
+			b10 = xy - wz
+			b11 = 1 - (xx + zz)
+			b12 = yz + wx
+			b20 = xz + wy
+			b21 = yz - wx
+			b22 = 1 - (xx + yy)
+			
+			m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11 = (
+				m0 * b00 + m4 * b01 + m8 * b02, m1 * b00 + m5 * b01 + m9 * b02,
+				m2 * b00 + m6 * b01 + m10 * b02, m3 * b00 + m7 * b01 + m11 * b02,
+				m0 * b10 + m4 * b11 + m8 * b12, m1 * b10 + m5 * b11 + m9 * b12,
+				m2 * b10 + m6 * b11 + m10 * b12, m3 * b10 + m7 * b11 + m11 * b12,
+				m0 * b20 + m4 * b21 + m8 * b22, m1 * b20 + m5 * b21 + m9 * b22,
+				m2 * b20 + m6 * b21 + m10 * b22, m3 * b20 + m7 * b21 + m11 * b22)
+		
+		elif ('s' == kind):
+			x = v[0]
+			y = v[1]
+			z = v[2]
+			m0 *= x; m1 *= x; m2 *= x; m3 *= x
+			m4 *= y; m5 *= y; m6 *= y; m7 *= y
+			m8 *= z; m9 *= z; m10 *= z; m11 *= z
+		
+		else:
+			# Full product, current * v for 'm' and v * current for 'p'
+			if ('m' == kind):
+				a00, a01, a02, a03, a10, a11, a12, a13, a20, a21, a22, a23, a30, a31, a32, a33 = m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11, m12, m13, m14, m15
+				b00, b01, b02, b03, b10, b11, b12, b13, b20, b21, b22, b23, b30, b31, b32, b33 = v[0:16]
+			
+			else:
+				a00, a01, a02, a03, a10, a11, a12, a13, a20, a21, a22, a23, a30, a31, a32, a33 = v[0:16]
+				b00, b01, b02, b03, b10, b11, b12, b13, b20, b21, b22, b23, b30, b31, b32, b33 = m0, m1, m2, m3, m4, m5, m6, m7, m8, m9, m10, m11, m12, m13, m14, m15
+			
+			m0 = b00 * a00 + b01 * a10 + b02 * a20 + b03 * a30
+			m1 = b00 * a01 + b01 * a11 + b02 * a21 + b03 * a31
+			m2 = b00 * a02 + b01 * a12 + b02 * a22 + b03 * a32
+			m3 = b00 * a03 + b01 * a13 + b02 * a23 + b03 * a33
+			m4 = b10 * a00 + b11 * a10 + b12 * a20 + b13 * a30
+			m5 = b10 * a01 + b11 * a11 + b12 * a21 + b13 * a31
+			m6 = b10 * a02 + b11 * a12 + b12 * a22 + b13 * a32
+			m7 = b10 * a03 + b11 * a13 + b12 * a23 + b13 * a33
+			m8 = b20 * a00 + b21 * a10 + b22 * a20 + b23 * a30
+			m9 = b20 * a01 + b21 * a11 + b22 * a21 + b23 * a31
+			m10 = b20 * a02 + b21 * a12 + b22 * a22 + b23 * a32
+			m11 = b20 * a03 + b21 * a13 + b22 * a23 + b23 * a33
+			m12 = b30 * a00 + b31 * a10 + b32 * a20 + b33 * a30
+			m13 = b30 * a01 + b31 * a11 + b32 * a21 + b33 * a31
+			m14 = b30 * a02 + b31 * a12 + b32 * a22 + b33 * a32
+			m15 = b30 * a03 + b31 * a13 + b32 * a23 + b33 * a33
+	
+	dest[0] = m0
+	dest[1] = m1
+	dest[2] = m2
+	dest[3] = m3
+	dest[4] = m4
+	dest[5] = m5
+	dest[6] = m6
+	dest[7] = m7
+	dest[8] = m8
+	dest[9] = m9
+	dest[10] = m10
+	dest[11] = m11
+	dest[12] = m12
+	dest[13] = m13
+	dest[14] = m14
+	dest[15] = m15
+	
+	return dest
+
+# The steps on (N,4,4) stacks of row-major matrices, i.e. the transposes of
+# the column-major values
+def _compose_eval_numpy(ops, out):
+	values = []
+	n = 1
+	
+	for kind, value in ops:
+		a = np.asarray(value, dtype=np.float64).reshape(-1, _compose_widths[kind])
+		values.append((kind, a))
+		n = max(n, len(a))
+	
+	r = np.zeros((n, 4, 4))
+	r[:, 0, 0] = r[:, 1, 1] = r[:, 2, 2] = r[:, 3, 3] = 1.0
+	
+	for kind, a in values:
+		if ('t' == kind):
+			r[:, 3, :] += np.einsum('nj,nji->ni', np.broadcast_to(a, (n, 3)), r[:, 0:3, :])
+		
+		elif ('s' == kind):
+			r[:, 0:3, :] *= a[:, :, None]
+		
+		elif ('r' == kind):
+			x, y, z, w = a.T
+			x2 = x + x
+			y2 = y + y
+			z2 = z + z
+			xx = x * x2
+			xy = x * y2
+			xz = x * z2
+			yy = y * y2
+			yz = y * z2
+			zz = z * z2
+			wx = w * x2
+			wy = w * y2
+			wz = w * z2
+			
+			b = np.empty((len(a), 3, 3))
+			b[:, 0, 0] = 1 - (yy + zz)
+			b[:, 0, 1] = xy + wz
+			b[:, 0, 2] = xz - wy
+			b[:, 1, 0] = xy - wz
+			b[:, 1, 1] = 1 - (xx + zz)
+			b[:, 1, 2] = yz + wx
+			b[:, 2, 0] = xz + wy
+			b[:, 2, 1] = yz - wx
+			b[:, 2, 2] = 1 - (xx + yy)
+			
+			r[:, 0:3, :] = b @ r[:, 0:3, :]
+		
+		elif ('m' == kind):
+			r = a.reshape(-1, 4, 4) @ r
+		
+		else:
+			r = r @ a.reshape(-1, 4, 4)
+	
+	if (out is None):
+		return r.reshape(n, 16)
+	
+	_batch_out_view(out, 16)[...] = r.reshape(n, 16)
+	
+	return out
+
+################################################################################
+
+# Value types
+#
+# Optional compact alternatives to the lists returned by vec3_create, mat4_create
+# and friends. Each is an array('f') (or array('d') with typecode='d') holding raw
+# floats, so it takes a fraction of the memory of a list and exposes the buffer
+# protocol : it can be handed to OpenGL or NumPy without copying. Indexing works
+# as with lists, so these can be passed to every vec3_*, mat4_* and quat_*
+# function as source or dest.
+
+class _valuetype(array):
+	__slots__ = ()
+	size = 0
+	
+	def __new__(cls, values=None, typecode='f'):
+		self = array.__new__(cls, typecode, bytes(cls.size * array(typecode).itemsize))
+		
+		if (values is not None):
+			for i in range(cls.size):
+				self[i] = values[i]
+		
+		return self
+	
+	def __copy__(self):
+		return self.__class__(self, self.typecode)
+	
+	def __deepcopy__(self, memo):
+		return self.__class__(self, self.typecode)
+	
+	def __reduce_ex__(self, protocol):
+		return (self.__class__, (self.tolist(), self.typecode))
+
+class Vec3(_valuetype):
+	__slots__ = ()
+	size = 3
+
+class Vec4(_valuetype):
+	__slots__ = ()
+	size = 4
+
+class Quat(_valuetype):
+	__slots__ = ()
+	size = 4
+
+class Mat3(_valuetype):
+	__slots__ = ()
+	size = 9
+
+# kind is one of MAT4_GENERAL, MAT4_AFFINE or MAT4_RIGID and selects the fast
+# path used by mat4_inverse. The mat4 builders set it on their dest, values
+# written by hand have to be flagged by the caller.
+class Mat4(_valuetype):
+	__slots__ = ('kind',)
+	size = 16
+	
+	def __new__(cls, values=None, typecode='f', kind=MAT4_GENERAL):
+		self = _valuetype.__new__(cls, values, typecode)
+		self.kind = kind
+		
+		return self
+	
+	def __copy__(self):
+		return self.__class__(self, self.typecode, self.kind)
+	
+	def __deepcopy__(self, memo):
+		return self.__class__(self, self.typecode, self.kind)
+	
+	def __reduce_ex__(self, protocol):
+		return (self.__class__, (self.tolist(), self.typecode, self.kind))
+
+################################################################################
+
+# Transform pool
+#
+# Keeps many 4x4 matrices in a single preallocated (capacity x 16) float buffer
+# and hands out integer handles instead of separate lists. view(handle) returns a
+# writable 16 element memoryview into the buffer which can be passed as source or
+# dest to any mat4_* function, e.g. mat4_translate(pool.view(h), v, None).
+#
+# Views stay valid until the pool grows or is compacted, both of which move the
+# storage. Handles stay valid until released, or until compact() renumbers them.
+
+class TransformPool:
+	def __init__(self, capacity=1024, typecode='f'):
+		self.typecode = typecode
+		self.capacity = 0
+		self.count = 0				# Handles below count have been handed out at least once
+		self.free = []
+		self.alive = bytearray()
+		self.data = array(typecode)
+		self.grow(capacity)
+	
+	def size(self):
+		return self.count - len(self.free)
+	
+	def grow(self, capacity):
+		if capacity <= self.capacity :
+			return
+		
+		# Build a new buffer rather than resizing, as views may still reference the old one
+		extra = capacity - self.capacity
+		self.data = self.data + array(self.typecode, bytes(extra * 16 * self.data.itemsize))
+		self.alive = self.alive + bytearray(extra)
+		self.capacity = capacity
+	
+	def alloc(self, mat=None):
+		if self.free :
+			handle = self.free.pop()
+		
+		else:
+			if self.count == self.capacity :
+				self.grow(max(16, self.capacity * 2))
+			
+			handle = self.count
+			self.count += 1
+		
+		self.alive[handle] = 1
+		
+		if (mat is None):
+			mat4_identity(self.view(handle))
+		
+		else:
+			self.setMatrix(handle, mat)
+		
+		return handle
+	
+	def release(self, handle):
+		if self.alive[handle] :
+			self.alive[handle] = 0
+			self.free.append(handle)
+	
+	def isAlive(self, handle):
+		return 0 <= handle < self.count and 1 == self.alive[handle]
+	
+	def view(self, handle):
+		o = handle * 16
+		return memoryview(self.data)[o:o + 16]
+	
+	def getMatrix(self, handle, dest):
+		o = handle * 16
+		data = self.data
+		
+		for i in range(16):
+			dest[i] = data[o + i]
+		
+		if (type(dest) is Mat4):
+			dest.kind = MAT4_GENERAL
+		
+		return dest
+	
+	def setMatrix(self, handle, mat):
+		o = handle * 16
+		data = self.data
+		
+		for i in range(16):
+			data[o + i] = mat[i]
+	
+	# Contiguous (count x 16) view of all matrices handed out so far, including
+	# released ones, suitable for the *_batch functions.
+	def matrices(self):
+		if (np is not None):
+			return np.frombuffer(self.data, dtype=self.data.typecode, count=self.count * 16).reshape(-1, 16)
+		
+		return memoryview(self.data)[0:self.count * 16]
+	
+	# Moves live matrices down over released slots so they are packed at the front
+	# of the buffer. Returns a dict mapping old handles to new ones; handles not in
+	# the dict are unchanged.
+	def compact(self):
+		remap = {}
+		data = self.data
+		alive = self.alive
+		dst = 0
+		
+		for src in range(self.count):
+			if not alive[src] :
+				continue
+			
+			if src != dst :
+				data[dst * 16:dst * 16 + 16] = data[src * 16:src * 16 + 16]
+				alive[dst] = 1
+				alive[src] = 0
+				remap[src] = dst
+			
+			dst += 1
+		
+		self.count = dst
+		self.free = []
+		
+		return remap
+
+################################################################################
+
+# Transform
+#
+# Keeps a transform as translation (vec3), rotation (quat) and scale (vec3) and
+# only builds the 4x4 matrix when it is read, caching it until the next change.
+# Composition goes through quaternion math, so transforms can be combined and
+# interpolated without decomposing and recomposing matrices.
+#
+# After writing into translation, rotation or scale directly, call invalidate().
+# Composition carries scale component-wise, which is exact for uniform scale.
+
+class Transform:
+	__slots__ = ('translation', 'rotation', 'scale', '_matrix', '_valid')
+	
+	def __init__(self, translation=None, rotation=None, scale=None):
+		self.translation = vec3_create(translation)
+		self.rotation = quat_create(rotation)
+		self.scale = vec3_create(scale)
+		self._matrix = mat4_create(None)
+		self._valid = False
+		
+		if rotation is None:
+			self.rotation[3] = 1.0
+		
+		if scale is None:
+			self.scale[0] = self.scale[1] = self.scale[2] = 1.0
+	
+	def invalidate(self):
+		self._valid = False
+	
+	def setTranslation(self, vec):
+		vec3_set(vec, self.translation)
+		self._valid = False
+	
+	def setRotation(self, quat):
+		quat_set(quat, self.rotation)
+		self._valid = False
+	
+	def setScale(self, vec):
+		vec3_set(vec, self.scale)
+		self._valid = False
+	
+	def set(self, other):
+		vec3_set(other.translation, self.translation)
+		quat_set(other.rotation, self.rotation)
+		vec3_set(other.scale, self.scale)
+		self._valid = False
+		
+		return self
+	
+	# Sets translation, rotation and scale from a matrix through mat4_decompose
+	def setMatrix(self, mat):
+		translation, rotation, scale = mat4_decompose(mat)
+		vec3_set(translation, self.translation)
+		quat_set(rotation, self.rotation)
+		vec3_set(scale, self.scale)
+		self._valid = False
+		
+		return self
+	
+	# Moves along the transform's own axes, like mat4_translate on its matrix
+	def translate(self, vec):
+		x = vec[0] * self.scale[0]
+		y = vec[1] * self.scale[1]
+		z = vec[2] * self.scale[2]
+		
+		t = [x, y, z]
+		quat_multiplyVec3(self.rotation, t, None)
+		vec3_add(self.translation, t, None)
+		self._valid = False
+		
+		return self
+	
+	# Rotates about the transform's own axes
+	def rotate(self, quat):
+		quat_multiply(self.rotation, quat, None)
+		self._valid = False
+		
+		return self
+	
+	# Matrix of the transform. Without dest the cached matrix itself is returned,
+	# which must not be modified.
+	def matrix(self, dest=None):
+		m = self._matrix
+		
+		if not self._valid:
+			mat4_fromRotationTranslationScale(self.rotation, self.translation, self.scale, m)
+			self._valid = True
+		
+		if (dest is None):
+			return m
+		
+		return mat4_set(m, dest)
+	
+	# Composes self * other, other being applied first as with mat4_multiply.
+	# If dest is None, the result is stored in self.
+	def multiply(self, other, dest=None):
+		if (dest is None):
+			dest = self
+		
+		t = [other.translation[0] * self.scale[0], other.translation[1] * self.scale[1], other.translation[2] * self.scale[2]]
+		quat_multiplyVec3(self.rotation, t, None)
+		
+		dest.translation[0] = self.translation[0] + t[0]
+		dest.translation[1] = self.translation[1] + t[1]
+		dest.translation[2] = self.translation[2] + t[2]
+		
+		quat_multiply(self.rotation, other.rotation, dest.rotation)
+		vec3_multiply(self.scale, other.scale, dest.scale)
+		dest._valid = False
+		
+		return dest
+	
+	# Maps a point through the transform without building the matrix
+	def multiplyVec3(self, vec, dest=None):
+		if (dest is None):
+			dest = vec
+		
+		vec3_multiply(vec, self.scale, dest)
+		quat_multiplyVec3(self.rotation, dest, None)
+		vec3_add(dest, self.translation, None)
+		
+		return dest
+	
+	# Interpolates towards other, with lerp for translation and scale and slerp
+	# for rotation. If dest is None, the result is stored in self.
+	def interpolate(self, other, t, dest=None):
+		if (dest is None):
+			dest = self
+		
+		vec3_lerp(self.translation, other.translation, t, dest.translation)
+		quat_slerp(self.rotation, other.rotation, t, dest.rotation)
+		vec3_lerp(self.scale, other.scale, t, dest.scale)
+		dest._valid = False
+		
+		return dest
+
+################################################################################
+
+# Scene graph
+#
+# Transform hierarchy stored as flat arrays : one parent index per node (-1 for
+# roots) and a local translation, rotation quaternion and scale. update()
+# rebuilds the local matrices and then computes the world matrices level by
+# level, parents before children, with one mat4_multiply_batch per depth level
+# instead of one matstack push/mult/pop per node.
+#
+# World matrices are cached. Setting a node's translation, rotation, scale or
+# parent marks it dirty, and update() only recomputes the dirty nodes and their
+# subtrees. multiplies and skipped count the parent * local products computed
+# and avoided so far, see resetCounters().
+
+class SceneGraph:
+	def __init__(self):
+		self.parents = []
+		self.translations = array('d')
+		self.rotations = array('d')
+		self.scales = array('d')
+		self.locals = array('d')
+		self.worlds = array('d')
+		self.levels = None		# Node indices per depth, rebuilt when the hierarchy changes
+		self.dirty = bytearray()	# 1 for nodes whose local transform changed since the last update
+		self.multiplies = 0
+		self.skipped = 0
+	
+	# Marks one node, or every node when index is None, for recomputation, e.g.
+	# after writing into the translations, rotations or scales arrays directly.
+	def markDirty(self, index=None):
+		if index is None:
+			n = len(self.dirty)
+			self.dirty[0:n] = b'\x01' * n
+		
+		else:
+			self.dirty[index] = 1
+	
+	def resetCounters(self):
+		self.multiplies = 0
+		self.skipped = 0
+	
+	def size(self):
+		return len(self.parents)
+	
+	# Appends to one of the arrays, replacing it if views currently pin its memory
+	def _append(self, name, values):
+		try:
+			getattr(self, name).extend(values)
+		except BufferError:
+			setattr(self, name, getattr(self, name) + array('d', values))
+	
+	def addNode(self, parent=-1, translation=None, rotation=None, scale=None):
+		if parent >= len(self.parents):
+			raise IndexError("parent %d does not exist" % parent)
+		
+		index = len(self.parents)
+		self.parents.append(parent)
+		
+		self._append('translations', (0.0, 0.0, 0.0) if translation is None else translation[0:3])
+		self._append('rotations', (0.0, 0.0, 0.0, 1.0) if rotation is None else rotation[0:4])
+		self._append('scales', (1.0, 1.0, 1.0) if scale is None else scale[0:3])
+		self._append('locals', mat4_identity(None))
+		self._append('worlds', mat4_identity(None))
+		self.dirty.append(1)
+		
+		self.levels = None
+		
+		return index
+	
+	def setParent(self, index, parent):
+		p = parent
+		while p >= 0:
+			if p == index:
+				raise ValueError("node %d cannot be parented to its own descendant %d" % (index, parent))
+			
+			p = self.parents[p]
+		
+		self.parents[index] = parent
+		self.dirty[index] = 1
+		self.levels = None
+	
+	def setTranslation(self, index, vec):
+		o = index * 3
+		self.translations[o] = vec[0]
+		self.translations[o + 1] = vec[1]
+		self.translations[o + 2] = vec[2]
+		self.dirty[index] = 1
+	
+	def setRotation(self, index, quat):
+		o = index * 4
+		self.rotations[o] = quat[0]
+		self.rotations[o + 1] = quat[1]
+		self.rotations[o + 2] = quat[2]
+		self.rotations[o + 3] = quat[3]
+		self.dirty[index] = 1
+	
+	def setScale(self, index, vec):
+		o = index * 3
+		self.scales[o] = vec[0]
+		self.scales[o + 1] = vec[1]
+		self.scales[o + 2] = vec[2]
+		self.dirty[index] = 1
+	
+	def getLocalMatrix(self, index, dest):
+		o = index * 16
+		for i in range(16):
+			dest[i] = self.locals[o + i]
+		
+		if (type(dest) is Mat4):
+			dest.kind = MAT4_AFFINE
+		
+		return dest
+	
+	def getWorldMatrix(self, index, dest):
+		o = index * 16
+		for i in range(16):
+			dest[i] = self.worlds[o + i]
+		
+		if (type(dest) is Mat4):
+			dest.kind = MAT4_AFFINE
+		
+		return dest
+	
+	# Contiguous (N x 16) view of the world matrices, valid until nodes are added
+	def worldMatrices(self):
+		if (np is not None):
+			return np.frombuffer(self.worlds, dtype=np.float64).reshape(-1, 16)
+		
+		return memoryview(self.worlds)
+	
+	def _buildLevels(self):
+		parents = self.parents
+		depth = [-1] * len(parents)
+		levels = []
+		
+		for i in range(len(parents)):
+			# Walk up to the first node of known depth, then assign depths on the way back
+			chain = []
+			p = i
+			while p >= 0 and depth[p] < 0:
+				chain.append(p)
+				p = parents[p]
+			
+			d = depth[p] if p >= 0 else -1
+			for node in reversed(chain):
+				d += 1
+				depth[node] = d
+				
+				if d == len(levels):
+					levels.append([])
+				
+				levels[d].append(node)
+		
+		if (np is not None):
+			parent_array = np.array(parents, dtype=np.intp)
+			levels = [np.array(level, dtype=np.intp) for level in levels]
+			levels = [(level, parent_array[level]) for level in levels]
+		
+		else:
+			levels = [(level, [parents[i] for i in level]) for level in levels]
+		
+		self.levels = levels
+	
+	# Local matrices of the given nodes from translation, rotation and scale, as
+	# built by mat4_fromRotationTranslation followed by mat4_scale
+	def _buildLocals(self, nodes):
+		if (np is None):
+			local = memoryview(self.locals)
+			
+			for i in nodes:
+				mat4_fromRotationTranslationScale(self.rotations[i * 4:i * 4 + 4], self.translations[i * 3:i * 3 + 3], self.scales[i * 3:i * 3 + 3], local[i * 16:i * 16 + 16])
+			
+			return
+		
+		t = np.frombuffer(self.translations, dtype=np.float64).reshape(-1, 3)[nodes]
+		r = np.frombuffer(self.rotations, dtype=np.float64).reshape(-1, 4)[nodes]
+		s = np.frombuffer(self.scales, dtype=np.float64).reshape(-1, 3)[nodes]
+		
+		np.frombuffer(self.locals, dtype=np.float64).reshape(-1, 16)[nodes] = mat4_fromRotationTranslationScale_batch(r, t, s)
+	
+	def update(self):
+		# Nothing to recompute, which covers an empty graph too
+		if (self.dirty.find(1) < 0):
+			return
+		
+		if self.levels is None:
+			self._buildLevels()
+		
+		if (np is None):
+			self._updatePython()
+		
+		else:
+			self._updateNumpy()
+		
+		n = len(self.dirty)
+		self.dirty[0:n] = bytes(n)
+	
+	def _updatePython(self):
+		dirty = self.dirty
+		self._buildLocals([i for i in range(len(dirty)) if dirty[i]])
+		
+		local = memoryview(self.locals)
+		world = memoryview(self.worlds)
+		stale = bytearray(dirty)
+		
+		for level, parents in self.levels:
+			for i, p in zip(level, parents):
+				o = i * 16
+				
+				if p < 0:
+					if stale[i]:
+						world[o:o + 16] = local[o:o + 16]
+				
+				elif stale[i] or stale[p]:
+					stale[i] = 1
+					mat4_multiply(world[p * 16:p * 16 + 16], local[o:o + 16], world[o:o + 16])
+					self.multiplies += 1
+				
+				else:
+					self.skipped += 1
+	
+	def _updateNumpy(self):
+		if not self.levels:
+			return
+		
+		stale = np.frombuffer(self.dirty, dtype=np.uint8).astype(bool)
+		self._buildLocals(np.flatnonzero(stale))
+		
+		local = np.frombuffer(self.locals, dtype=np.float64).reshape(-1, 16)
+		world = np.frombuffer(self.worlds, dtype=np.float64).reshape(-1, 16)
+		
+		roots, none = self.levels[0]
+		roots = roots[stale[roots]]
+		world[roots] = local[roots]
+		
+		for level, parents in self.levels[1:]:
+			stale[level] |= stale[parents]
+			selected = stale[level]
+			count = int(np.count_nonzero(selected))
+			
+			self.multiplies += count
+			self.skipped += len(level) - count
+			
+			if count:
+				level = level[selected]
+				product = world[parents[selected]]
+				mat4_multiply_batch(product, local[level])
+				world[level] = product
+
+################################################################################
+
+# Trig cache
+#
+# Turntables, gizmos and procedural animation tend to rotate by the same
+# quantized angles over and over. A TrigCache holds sin and cos for every half
+# step of one full turn, plus LRUs of sin/cos pairs and of rotation
+# quaternions and matrices keyed by (axis, angle). Angles off the step grid
+# fall back to sin and cos and are not stored.
+#
+# The cache is used explicitly rather than hooked into mat4_rotate and the like:
+# in CPython a lookup costs as much as calling sin and cos, so the hook made
+# those functions slower. The gain is in reusing whole rotations, which
+# quat() and mat4() return without rebuilding them.
+
+# Bounded mapping that evicts the least recently used entry, with hit and miss
+# counters
+class _lrucache:
+	def __init__(self, capacity=1024):
+		self.capacity = capacity
+		self.items = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+	
+	def resetCounters(self):
+		self.hits = 0
+		self.misses = 0
+	
+	def clear(self):
+		self.items.clear()
+	
+	def size(self):
+		return len(self.items)
+	
+	# Returns the value stored for key, or None
+	def get(self, key):
+		value = self.items.get(key)
+		
+		if (value is None):
+			self.misses += 1
+			return None
+		
+		self.items.move_to_end(key)
+		self.hits += 1
+		
+		return value
+	
+	def put(self, key, value):
+		self.items[key] = value
+		self.items.move_to_end(key)
+		
+		if (len(self.items) > self.capacity):
+			self.items.popitem(last=False)
+		
+		return value
+
+_trig_axes = { 'x' : (1.0, 0.0, 0.0), 'y' : (0.0, 1.0, 0.0), 'z' : (0.0, 0.0, 1.0) }
+
+class TrigCache:
+	# step is in radians and has to divide a full turn, 1/10 degree by default.
+	# capacity bounds both the LRU of sin/cos pairs and the LRU of rotations.
+	def __init__(self, step=pi / 1800, capacity=4096):
+		steps = int(round(2 * pi / step))
+		
+		if (steps < 1) or (abs(steps * step - 2 * pi) > 1e-9):
+			raise ValueError("step has to divide a full turn")
+		
+		# The table runs in half steps so that quat() finds the half angles of
+		# quaternions on the grid too
+		self.step = step
+		self.steps = steps * 2
+		self.invStep = 2 / step
+		self.sines = array('d', [sin(i * step * 0.5) for i in range(steps * 2)])
+		self.cosines = array('d', [cos(i * step * 0.5) for i in range(steps * 2)])
+		self.values = _lrucache(capacity)
+		self.rotations = _lrucache(capacity)
+	
+	def resetCounters(self):
+		self.values.resetCounters()
+		self.rotations.resetCounters()
+	
+	# Table index of angle, or None when it is off the step grid
+	def index(self, angle):
+		k = angle * self.invStep
+		i = int(round(k))
+		
+		if (abs(k - i) > 1e-6):
+			return None
+		
+		return i % self.steps
+	
+	# (sin, cos) of angle. Lookups are keyed on the exact angle, which is
+	# cheaper than quantizing it again; the grid only decides what gets stored.
+	def sincos(self, angle):
+		sc = self.values.get(angle)
+		
+		if (sc is not None):
+			return sc
+		
+		i = self.index(angle)
+		
+		if (i is None):
+			return sin(angle), cos(angle)
+		
+		return self.values.put(angle, (self.sines[i], self.cosines[i]))
+	
+	# Rotation of angle around axis ('x', 'y', 'z' or a unit vector) as a shared
+	# (x, y, z, w) tuple
+	def quat(self, axis, angle):
+		key = (axis if isinstance(axis, str) else tuple(axis), angle, 'quat')
+		q = self.rotations.get(key)
+		
+		if (q is None):
+			x, y, z = _trig_axes[axis] if isinstance(axis, str) else axis[0:3]
+			s, c = self.sincos(angle * 0.5)
+			q = (x * s, y * s, z * s, c)
+			
+			if (self.index(angle) is not None):
+				self.rotations.put(key, q)
+		
+		return q
+	
+	# Rotation matrix of angle around axis as a shared tuple of 16 values, or
+	# copied into dest when given
+	def mat4(self, axis, angle, dest=None):
+		key = (axis if isinstance(axis, str) else tuple(axis), angle, 'mat4')
+		m = self.rotations.get(key)
+		
+		if (m is None):
+			v = _trig_axes[axis] if isinstance(axis, str) else axis
+			m = tuple(mat4_rotate(mat4_identity([0.0] * 16), angle, v, [0.0] * 16))
+			
+			if (self.index(angle) is not None):
+				self.rotations.put(key, m)
+		
+		if (dest is None):
+			return m
+		
+		return mat4_set(m, dest)
+
+################################################################################
+
+# Matrix cache
+#
+# Cameras and shadow cascades rebuild the same projection and view matrices
+# every frame. A MatrixCache memoizes mat4_perspective, mat4_frustum,
+# mat4_ortho and mat4_lookAt on their exact arguments, together with the
+# matching inverse, computed on first request. Results are shared tuples, or
+# copied into dest when one is given.
+#
+# Rebuilding a projection is nearly as cheap as looking it up; the saving is in
+# the inverses, above all the inverse of proj * view needed for picking. Once
+# installed with set_matrix_cache(), vec3_unproject and Unprojector take it
+# from the cache instead of multiplying and inverting on every call.
+
+class MatrixCache:
+	def __init__(self, capacity=256):
+		self.entries = _lrucache(capacity)
+	
+	def clear(self):
+		self.entries.clear()
+	
+	def resetCounters(self):
+		self.entries.resetCounters()
+	
+	# Stores the [matrix, inverse] entry for key, building the matrix with a
+	# fresh list as dest
+	def _add(self, key, build, args):
+		return self.entries.put(key, [tuple(build(*(args + ([0.0] * 16,)))), None])
+	
+	def _result(self, entry, inverse, rigid, dest):
+		if inverse:
+			if (entry[1] is None):
+				m = [0.0] * 16
+				
+				if rigid:
+					mat4_inverse_rigid(entry[0], m)
+				
+				elif (mat4_inverse(entry[0], m) is None):
+					return None
+				
+				entry[1] = tuple(m)
+			
+			m = entry[1]
+		
+		else:
+			m = entry[0]
+		
+		if (dest is None):
+			return m
+		
+		if isinstance(dest, list):
+			dest[0:16] = m
+			return dest
+		
+		return mat4_set(m, dest)
+	
+	# With inverse True the methods return the inverse matrix instead, or None
+	# if it is singular
+	def frustum(self, left, right, bottom, top, near, far, dest=None, inverse=False):
+		key = ('frustum', left, right, bottom, top, near, far)
+		entry = self.entries.get(key)
+		
+		if (entry is None):
+			entry = self._add(key, mat4_frustum, (left, right, bottom, top, near, far))
+		
+		return self._result(entry, inverse, False, dest)
+	
+	def perspective(self, fovy, aspect, near, far, dest=None, inverse=False):
+		key = ('perspective', fovy, aspect, near, far)
+		entry = self.entries.get(key)
+		
+		if (entry is None):
+			entry = self._add(key, mat4_perspective, (fovy, aspect, near, far))
+		
+		return self._result(entry, inverse, False, dest)
+	
+	def ortho(self, left, right, bottom, top, near, far, dest=None, inverse=False):
+		key = ('ortho', left, right, bottom, top, near, far)
+		entry = self.entries.get(key)
+		
+		if (entry is None):
+			entry = self._add(key, mat4_ortho, (left, right, bottom, top, near, far))
+		
+		return self._result(entry, inverse, False, dest)
+	
+	def lookAt(self, eye, center, up, dest=None, inverse=False):
+		key = ('lookAt', eye[0], eye[1], eye[2], center[0], center[1], center[2], up[0], up[1], up[2])
+		entry = self.entries.get(key)
+		
+		if (entry is None):
+			entry = self._add(key, mat4_lookAt, (eye, center, up))
+		
+		return self._result(entry, inverse, True, dest)
+	
+	# Inverse of proj * view as a shared tuple, or None if it is singular. This
+	# is what vec3_unproject and Unprojector need, and it is keyed on the 32
+	# values of both matrices.
+	def viewProjInverse(self, view, proj, dest=None):
+		key = (tuple(view[0:16]), tuple(proj[0:16]))
+		entry = self.entries.get(key)
+		
+		if (entry is None):
+			m = mat4_multiply(proj, view, [0.0] * 16)
+			entry = self.entries.put(key, [None, tuple(m) if mat4_inverse(m, None) is not None else False])
+		
+		m = entry[1]
+		
+		if (m is False):
+			return None
+		
+		if (dest is None):
+			return m
+		
+		if isinstance(dest, list):
+			dest[0:16] = m
+			return dest
+		
+		return mat4_set(m, dest)
+
+_matrixcache = None
+
+# Installs cache for vec3_unproject and Unprojector, or removes it when None.
+# Returns the cache installed before.
+def set_matrix_cache(cache):
+	global _matrixcache
+	
+	previous = _matrixcache
+	_matrixcache = cache
+	
+	return previous
+
+def get_matrix_cache():
+	return _matrixcache
+
+################################################################################
+
+# Allocation checks
+
+# Peak bytes allocated while running fn(*args), temporaries included, as
+# traced by tracemalloc. Functions honouring the out parameter contract report
+# 0 when given a dest; Python floats come from a free list and do not count.
+def allocated_bytes(fn, *args):
+	# Warm up caches and free lists first
+	for i in range(3):
+		fn(*args)
+	
+	tracing = tracemalloc.is_tracing()
+	
+	if not tracing:
+		tracemalloc.start()
+	
+	try:
+		base = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		fn(*args)
+		peak = tracemalloc.get_traced_memory()[1]
+	
+	finally:
+		if not tracing:
+			tracemalloc.stop()
+	
+	return max(0, peak - base)
+
+################################################################################
+
+# Instrumentation
+#
+# enable_instrumentation() swaps every public vec3_, vec4_, mat3_, mat4_ and
+# quat_ function, and the matstack methods, for wrappers that count calls,
+# time and retained memory blocks. disable_instrumentation() puts the
+# originals back, so nothing is paid while it is off. Calls made from inside
+# the module are counted too, and times include nested calls. As with the
+# backends, names imported before enabling keep pointing at the originals.
+
+_instrument_prefixes = ('vec3_', 'vec4_', 'mat3_', 'mat4_', 'quat_')
+_instrument_classes = (matstack, fixedmatstack)
+_instrumented = {}
+_stats = {}
+_instrument_overhead = 0
+
+# Blocks the wrapper itself reports for a call that allocates nothing
+def _calibrate_instrumentation():
+	global _instrument_overhead
+	
+	_instrument_overhead = 0
+	wrapper = _instrument('', lambda: None)
+	
+	for i in range(100):
+		wrapper()
+	
+	record = _stats.pop('')
+	_instrument_overhead = int(round(record[2] / record[0]))
+
+def _instrument(name, fn):
+	record = _stats.setdefault(name, [0, 0.0, 0])
+	
+	# The block counts are read innermost, so that the timer floats are not
+	# counted as blocks of the call. The int holding the first count is, and
+	# _instrument_overhead takes it back out.
+	def wrapper(*args, **kwargs):
+		start = time.perf_counter()
+		blocks = sys.getallocatedblocks()
+		
+		try:
+			return fn(*args, **kwargs)
+		
+		finally:
+			blocks = sys.getallocatedblocks() - blocks - _instrument_overhead
+			record[1] += time.perf_counter() - start
+			
+			if (blocks > 0):
+				record[2] += blocks
+			
+			record[0] += 1
+	
+	wrapper.__name__ = fn.__name__
+	wrapper.__doc__ = fn.__doc__
+	wrapper.__wrapped__ = fn
+	
+	return wrapper
+
+def enable_instrumentation():
+	if _instrumented:
+		return
+	
+	_calibrate_instrumentation()
+	
+	g = globals()
+	
+	for name, fn in list(g.items()):
+		if name.startswith(_instrument_prefixes) and callable(fn):
+			_instrumented[name] = fn
+			g[name] = _instrument(name, fn)
+	
+	for cls in _instrument_classes:
+		for name, fn in list(vars(cls).items()):
+			if not name.startswith('__') and callable(fn):
+				_instrumented[(cls, name)] = fn
+				setattr(cls, name, _instrument(cls.__name__ + '.' + name, fn))
+
+def disable_instrumentation():
+	g = globals()
+	
+	for key, fn in _instrumented.items():
+		if isinstance(key, tuple):
+			setattr(key[0], key[1], fn)
+		
+		else:
+			g[key] = fn
+	
+	_instrumented.clear()
+
+def is_instrumented():
+	return bool(_instrumented)
+
+def reset_instrumentation():
+	for record in _stats.values():
+		record[0:3] = [0, 0.0, 0]
+
+# Per function stats of the functions called at least once, as
+# { name : { 'calls', 'seconds', 'retained' } }, retained being the memory
+# blocks still allocated when the calls returned. Temporaries freed before a
+# call returns do not show up there; allocated_bytes() measures those.
+def instrumentation_stats():
+	stats = {}
+	
+	for name, record in _stats.items():
+		if (record[0] > 0):
+			stats[name] = { 'calls' : record[0], 'seconds' : record[1], 'retained' : record[2] }
+	
+	return stats
+
+def instrumentation_json(indent=None):
+	return json.dumps(instrumentation_stats(), indent=indent, sort_keys=True)
+
+################################################################################
+
+# Backends
+#
+# The default 'python' backend works on plain lists. The 'numpy' backend makes
+# vec3_create, mat4_create, quat_create and the other creators return NumPy
+# arrays, and swaps in NumPy versions of the heavier matrix functions. Every
+# other function works on those arrays unchanged through indexing, so values
+# stay NumPy arrays from end to end without per-call conversions.
+#
+# Select the backend with the GLMATRIX_BACKEND environment variable, or with
+# set_backend() before "from glmatrix import *". Names imported earlier keep
+# pointing at the functions of the previous backend.
+
+_backend = 'python'
+_np_dtype = None
+_python_functions = {}
+
+def _np_values(values, size):
+	dest = np.zeros(size, _np_dtype)
+	
+	if values is not None:
+		dest[:] = values[0:size]
+	
+	return dest
+
+# Writes the first n values into dest, which may be a list or any writable buffer
+def _np_store(dest, values, n):
+	if isinstance(dest, list):
+		dest[0:n] = np.ravel(values).tolist()
+	
+	else:
+		np.asarray(dest)[0:n] = np.ravel(values)
+	
+	return dest
+
+def _np_vec3_create(vec):
+	return _np_values(vec, 3)
+
+def _np_vec4_create(vec):
+	return _np_values(vec, 4)
+
+def _np_mat3_create(mat):
+	return _np_values(mat, 9)
+
+def _np_mat4_create(mat):
+	return _np_values(mat, 16)
+
+def _np_quat_create(quat):
+	return _np_values(quat, 4)
+
+def _np_mat4_set(mat, dest):
+	if (type(dest) is Mat4):
+		dest.kind = _mat4_kind(mat)
+	
+	return _np_store(dest, np.asarray(mat[0:16]), 16)
+
+def _np_mat4_identity(dest):
+	if (dest is None):
+		dest = _np_values(None, 16)
+	
+	elif (type(dest) is Mat4):
+		dest.kind = MAT4_RIGID
+	
+	return _np_store(dest, _np_identity, 16)
+
+def _np_mat4_transpose(mat, dest):
+	if (dest is None):
+		dest = mat
+	
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_GENERAL
+	
+	return _np_store(dest, np.reshape(mat, (4, 4)).T, 16)
+
+def _np_mat4_inverse(mat, dest):
+	if (type(mat) is Mat4) and (MAT4_GENERAL != mat.kind):
+		return _python_functions['mat4_inverse'](mat, dest)
+	
+	if (dest is None):
+		dest = mat
+	
+	try:
+		inv = np.linalg.inv(np.reshape(mat, (4, 4)))
+	except np.linalg.LinAlgError:
+		return None
+	
+	if (type(dest) is Mat4):
+		dest.kind = MAT4_GENERAL
+	
+	return _np_store(dest, inv, 16)
+
+def _np_mat4_multiply(mat, mat2, dest=None):
+	if (dest is None):
+		dest = mat
+	
+	if (type(dest) is Mat4):
+		dest.kind = min(_mat4_kind(mat), _mat4_kind(mat2))
+	
+	# Row-major views of column-major data hold the transposes, so A*B is B'A'
+	return _np_store(dest, np.reshape(mat2, (4, 4)) @ np.reshape(mat, (4, 4)), 16)
+
+def _np_mat4_multiplyVec3(mat, vec, dest):
+	if (dest is None):
+		dest = vec
+	
+	m = np.reshape(mat, (4, 4))
+	return _np_store(dest, np.asarray(vec[0:3]) @ m[:3, :3] + m[3, :3], 3)
+
+def _np_mat4_multiplyVec4(mat, vec, dest):
+	if (dest is None):
+		dest = vec
+	
+	return _np_store(dest, np.asarray(vec[0:4]) @ np.reshape(mat, (4, 4)), 4)
+
+_numpy_functions = {
+	'vec3_create' : _np_vec3_create,
+	'vec4_create' : _np_vec4_create,
+	'mat3_create' : _np_mat3_create,
+	'mat4_create' : _np_mat4_create,
+	'quat_create' : _np_quat_create,
+	'mat4_set' : _np_mat4_set,
+	'mat4_identity' : _np_mat4_identity,
+	'mat4_transpose' : _np_mat4_transpose,
+	'mat4_inverse' : _np_mat4_inverse,
+	'mat4_multiply' : _np_mat4_multiply,
+	'mat4_multiplyVec3' : _np_mat4_multiplyVec3,
+	'mat4_multiplyVec4' : _np_mat4_multiplyVec4,
+}
+
+# Selects the 'python' or 'numpy' backend. dtype sets the element type of the
+# arrays created by the numpy backend, float64 by default.
+def set_backend(name, dtype=None):
+	global _backend, _np_dtype, _np_identity
+	
+	g = globals()
+	
+	# Swap the plain functions, then wrap the new ones
+	instrumented = is_instrumented()
+	
+	if instrumented:
+		disable_instrumentation()
+	
+	try:
+		if not _python_functions :
+			for fn in _numpy_functions :
+				_python_functions[fn] = g[fn]
+		
+		if 'numpy' == name :
+			if np is None:
+				raise ImportError("the numpy backend requires NumPy")
+			
+			_np_dtype = np.dtype(dtype or np.float64)
+			_np_identity = np.identity(4, _np_dtype).ravel()
+			g.update(_numpy_functions)
+		
+		elif 'python' == name :
+			g.update(_python_functions)
+		
+		else:
+			raise ValueError("unknown backend '%s', expected 'python' or 'numpy'" % name)
+		
+		_backend = name
+	
+	finally:
+		if instrumented:
+			enable_instrumentation()
+
+def get_backend():
+	return _backend
+
+if os.environ.get('GLMATRIX_BACKEND'):
+	set_backend(os.environ['GLMATRIX_BACKEND'])